@@ -30,22 +30,15 @@ pool.join()
 
 data_adj_matrix = net.adjacency_matrix.copy()
 
-surrs_adj_matrices = []
-
-for i in range(NUM_SURR):
-    print("surr %d/%d computing..." % (i+1, NUM_SURR))
-    pool = Pool(20)
-    surrs.construct_fourier_surrogates(pool = pool)
-    surrs.add_seasonality(a[0], a[1], a[2])
-
-    net.data = surrs.get_surr()
-    net.wavelet(8, 'y', cut = 1, pool = pool)
-    net.get_adjacency_matrix(net.phase, method = "MIEQQ", num_workers = 20, pool = None, use_queue = True)
-    pool.close()
-    pool.join()
-    surrs_adj_matrices.append(net.adjacency_matrix)
+# surrogate matrices are reduced on the fly, the state is checkpointed so the run can be resumed
+pool = Pool(20)
+p_vals, significance = net.get_adjacency_significance(surrs, NUM_SURR, 8, 'y', cut = 1, method = "MIEQQ", 
+                            surr_type = 'FT', seasonality = a, pool = pool, 
+                            checkpoint = "8yr-phase-scale-net-surrs-1000FT.ckpt", checkpoint_every = 10)
+pool.close()
+pool.join()
 
 import cPickle
 with open("8yr-phase-scale-net-surrs-1000FT.bin", "wb") as f:
-    cPickle.dump({'data' : data_adj_matrix, 'surrs' : surrs_adj_matrices}, f, protocol = cPickle.HIGHEST_PROTOCOL)
-
+    cPickle.dump({'data' : data_adj_matrix, 'p_vals' : p_vals, 'significance' : significance, 
+        'surr_mean' : net.surr_mean, 'surr_var' : net.surr_var}, f, protocol = cPickle.HIGHEST_PROTOCOL)
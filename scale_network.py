@@ -44,33 +44,29 @@ def _get_phase_coherence(a):
     return i, j, coh
 
 
-def _get_continuous_phase(a):
+def _get_continuous_phase(phase):
     """
-    Tranforms phases to continuous, strictly increasing.
+    Transforms phases (time x space) to continuous, increasing phase by adding 2*pi
+    to the rest of the time series at every jump larger than 1. Returns new array,
+    as get_continuous_phase in data_class.
     """
 
-    i, j, ph1 = a
-    # get continuous phase
-    for ii in range(ph1.shape[0] - 1):
-        if np.abs(ph1[ii+1] - ph1[ii]) > 1:
-            ph1[ii+1: ] += 2 * np.pi
+    jumps = np.greater(np.abs(np.diff(phase, axis = 0)), 1)
+    cont_phase = np.array(phase, copy = True)
+    cont_phase[1:, ...] += 2 * np.pi * np.cumsum(jumps, axis = 0)
 
-    return i, j, ph1
+    return cont_phase
 
 
 
-def _get_phase_fluctuations(a):
+def _get_phase_fluctuations(phase, omega):
     """
-    Gets phase fluctuations.
+    Gets phase fluctuations of phases (time x space) from stationary phase increasing with omega.
     """
 
-    i, j, omega, ph = a
+    t = np.arange(phase.shape[0]).reshape((-1,) + (1,)*(phase.ndim - 1))
 
-    ph0 = ph[0]
-    for t in range(ph.shape[0]):
-        ph[t] -= ph0 + omega*t 
-
-    return i, j, ph
+    return phase - (t * omega + phase[0, ...])
 
 
 
@@ -104,6 +100,403 @@ def _get_mutual_inf_KNN(a):
     return i, j, MI.knn_mutual_information(ph1, ph2, k = 32, dualtree = True)
 
 
+def _get_tiles(n, tile_size):
+    """
+    Returns list of (row_start, row_end, col_start, col_end) tiles covering
+    the upper triangle (including diagonal) of n x n matrix.
+    """
+
+    tiles = []
+    for i0 in range(0, n, tile_size):
+        for j0 in range(i0, n, tile_size):
+            tiles.append((i0, min(i0 + tile_size, n), j0, min(j0 + tile_size, n)))
+
+    return tiles
+
+
+
+def _get_pairwise_value(ph1, ph2, method):
+    """
+    Computes pairwise measure between two time series according to method.
+    """
+
+    if method == "MPC":
+        # get phase diff
+        diff = ph1 - ph2
+        # compute mean phase coherence
+        return np.power(np.mean(np.cos(diff)), 2) + np.power(np.mean(np.sin(diff)), 2)
+
+    elif method == "MIEQQ":
+        return MI.mutual_information(ph1, ph2, algorithm = 'EQQ2', bins = 4, log2 = False)
+
+    elif method == "MIKNN":
+        return MI.knn_mutual_information(ph1, ph2, k = 32, dualtree = True)
+
+    elif method == "MIGAU":
+        corr = np.corrcoef([ph1, ph2])[0, 1]                    
+        return -0.5 * np.log(1 - np.power(corr, 2)) if corr < 1. else 0
+
+    elif method == "COV":
+        return np.cov(ph1, ph2, ddof = 1)[0,1]
+
+    elif method == "CORR":
+        return st.pearsonr(ph1, ph2)[0]
+
+    elif method == "WCOH":
+        # input field must be wave from wavelet!!!!
+        w1 = np.complex(0, 0)
+        w2 = w1; w3 = w1
+        for t in range(0, ph1.shape[0]):
+            w1 += ph1[t] * np.conjugate(ph2[t])
+            w2 += ph1[t] * np.conjugate(ph1[t])
+            w3 += ph2[t] * np.conjugate(ph2[t])
+        w1 /= np.sqrt(np.abs(w2) * np.abs(w3))
+        return np.abs(w1)
+
+    elif method[0] == 'L':
+        p = int(method[1])
+        res = 0
+        for t in range(ph1.shape[0]):
+            res += np.power(np.abs(ph1[t] - ph2[t]), p)
+        return np.power(res, 1./p)
+
+
+
+def _get_EQQ2_labels(field, bins):
+    """
+    Quantizes every column of field (time x space) to equiquantal bin labels
+    with the same bin edges as EQQ2 algorithm in mutual information.
+    Returns uint8 array of labels 0 ... bins-1 of the same shape as field.
+    """
+
+    num_tm = field.shape[0]
+    field_sorted = np.sort(field, axis = 0)
+    cols = np.arange(field.shape[1])
+    one_bin_count = num_tm // bins
+    labels = np.zeros(field.shape, dtype = np.uint8)
+
+    for i in range(1, bins):
+        idx = i * one_bin_count
+        val = field_sorted[idx, :]
+        # first and last index of the run of samples with the same value as the edge
+        first = np.sum(field_sorted < val, axis = 0)
+        last = np.sum(field_sorted <= val, axis = 0) - 1
+        # if the edge value is tied, the edge is shifted outside the run of tied samples
+        # exactly as the edge search in EQQ2 mutual information does
+        edge_idx = np.where(first == idx, np.where(last == idx, idx, idx - 1), 
+                        np.where(last == idx, idx + 1, np.where(idx - first <= last - idx, first - 2, last + 2)))
+        edge_idx = np.minimum(edge_idx, num_tm - 1)
+        labels += np.greater_equal(field, field_sorted[edge_idx, cols]).astype(np.uint8)
+
+    return labels
+
+
+
+# memory budget (bytes) of MIEQQ / CMIEQQ histograms of tiles computed at once, tiles are shrunk to fit
+HIST_TILE_BYTES = 2**28
+
+
+
+def _get_hist_tile_size(tile_size, method, cond_states = None, num_workers = 0):
+    """
+    Returns tile size for histogram methods (MIEQQ, CMIEQQ) shrunk so that histograms of
+    tiles computed at once by all workers fit into HIST_TILE_BYTES. A tile holds 
+    tile^2 x 4 x states x 4 histogram values, about 32 bytes each with the temporaries.
+    Other methods keep tile_size.
+    """
+
+    if method == "MIEQQ":
+        num_states = 1
+    elif method == "CMIEQQ":
+        num_states = cond_states
+    else:
+        return tile_size
+
+    budget = HIST_TILE_BYTES / float(max(1, num_workers))
+
+    return max(1, min(tile_size, int(np.sqrt(budget / (16. * num_states * 32)))))
+
+
+
+def _get_cond_labels(cond):
+    """
+    Bins (possibly multidimensional) condition to 4 bins and returns one label per time point
+    and the number of states. Only states which actually occur are labelled (0 ... states - 1),
+    so histograms do not grow as 4^dim of the condition.
+    """
+
+    cond_labels = _get_EQQ2_labels(np.atleast_2d(cond).T, bins = 4)
+    states, labels = np.unique(cond_labels, axis = 0, return_inverse = True)
+
+    return np.reshape(labels, (-1,)), states.shape[0]
+
+
+
+def _get_num_cond_states(cond):
+    """
+    Returns number of occurring states of (possibly multidimensional) condition binned to 4 bins.
+    """
+
+    return _get_cond_labels(cond)[1]
+
+
+
+def _prepare_pairwise_field(field, method, dtype = np.float64, cond = None):
+    """
+    Prepares flattened field (time x space) for batched computation of pairwise measure,
+    so that expensive per-node transformations are done only once.
+        MPC - phases are transformed to complex unit vectors exp(i*phi)
+        WCOH - wave is normalised to unit norm per grid point
+        L1, L2 - field is cast to dtype
+        MIGAU, CORR - field is centered and normalised to unit norm per grid point
+        COV - field is centered and scaled by 1/sqrt(T-1)
+        MIEQQ - field is quantized to 4 equiquantal bins stored as uint8 labels
+        CMIEQQ - as MIEQQ, but the labels are joint (node, condition) labels
+        CMIGAU - linear dependence on condition is regressed out from the field and residuals
+            are normalised to unit norm
+        other methods - field is used as it is
+    dtype is the precision of the computation (np.float64 or np.float32).
+    cond is the condition (1D time series or list of them) for conditioned methods.
+    """
+
+    cdtype = np.complex64 if dtype == np.float32 else np.complex128
+
+    if method == "MPC":
+        return np.exp(1j * field).astype(cdtype)
+    elif method == "WCOH":
+        wave = field.astype(cdtype)
+        wave /= np.sqrt(np.sum(np.power(np.abs(wave), 2), axis = 0))
+
+        return wave
+    elif method in ["L1", "L2"]:
+        return field.astype(dtype)
+    elif method in ["MIGAU", "CORR", "COV"]:
+        # correlations (covariances) of all pairs are then products of columns
+        centered = field - np.mean(field, axis = 0)
+        if method == "COV":
+            centered /= np.sqrt(field.shape[0] - 1.)
+        else:
+            centered /= np.sqrt(np.sum(centered * centered, axis = 0))
+
+        return centered.astype(dtype)
+    elif method == "MIEQQ":
+        return _get_EQQ2_labels(field, bins = 4)
+    elif method == "CMIEQQ":
+        # bin the condition only once and encode multidimensional condition as one label
+        cond_labels, num_states = _get_cond_labels(cond)
+        if 4*num_states <= 2**8:
+            label_dtype = np.uint8
+        elif 4*num_states <= 2**16:
+            label_dtype = np.uint16
+        else:
+            raise Exception("Condition has too many states (%d) for batched conditioned network." % num_states)
+        labels = _get_EQQ2_labels(field, bins = 4).astype(np.int64) * num_states + cond_labels[:, np.newaxis]
+
+        return labels.astype(label_dtype)
+    elif method == "CMIGAU":
+        # residuals of linear regression on condition (with intercept), i.e. partial correlation
+        # is obtained as correlation of residuals
+        cond = np.vstack([np.ones((1, field.shape[0]))] + [np.atleast_2d(cond)]).T
+        resid = field - np.dot(cond, np.linalg.lstsq(cond, field, rcond = -1)[0])
+        resid /= np.sqrt(np.sum(resid * resid, axis = 0))
+
+        return resid.astype(dtype)
+    else:
+        return field
+
+
+
+def _get_pairwise_tile(prep, i0, i1, j0, j1, method, cond_states = None):
+    """
+    Computes one tile (rows i0:i1 x columns j0:j1) of the adjacency matrix
+    from the prepared field. Methods without batched implementation are 
+    computed pair by pair.
+    cond_states is the number of condition states for CMIEQQ method.
+    """
+
+    if method == "MPC":
+        # mean phase coherence as |sum exp(i*phi_i) exp(-i*phi_j)|^2 / T^2
+        coh = np.dot(prep[:, i0:i1].T, np.conjugate(prep[:, j0:j1]))
+        return np.power(np.abs(coh), 2) / float(prep.shape[0]**2)
+
+    elif method == "WCOH":
+        # wavelet coherence as |W_i W_j^H| with W normalised
+        return np.abs(np.dot(prep[:, i0:i1].T, np.conjugate(prep[:, j0:j1])))
+
+    elif method in ["CORR", "COV"]:
+        return np.dot(prep[:, i0:i1].T, prep[:, j0:j1])
+
+    elif method == "MIGAU":
+        # Gaussian MI from correlation, zero for perfectly correlated pairs as in pairwise computation
+        corr = np.dot(prep[:, i0:i1].T, prep[:, j0:j1])
+        return np.where(corr < 1., -0.5 * np.log(np.maximum(1 - np.power(corr, 2), np.finfo(prep.dtype).tiny)), 0)
+
+    elif method == "L1":
+        from scipy.spatial.distance import cdist
+        return cdist(prep[:, i0:i1].T, prep[:, j0:j1].T, 'cityblock')
+
+    elif method == "L2":
+        # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+        a = prep[:, i0:i1]
+        b = prep[:, j0:j1]
+        dist = np.sum(a*a, axis = 0)[:, np.newaxis] + np.sum(b*b, axis = 0)[np.newaxis, :] - 2 * np.dot(a.T, b)
+        return np.sqrt(np.maximum(dist, 0))
+
+    elif method == "MIEQQ":
+        # joint histograms of all pairs in tile as product of one-hot encoded labels
+        bins = 4
+        one_hot_i = np.equal(prep[:, i0:i1, np.newaxis], np.arange(bins)).reshape((prep.shape[0], -1)).astype(np.float32)
+        one_hot_j = np.equal(prep[:, j0:j1, np.newaxis], np.arange(bins)).reshape((prep.shape[0], -1)).astype(np.float32)
+        count_xy = np.dot(one_hot_i.T, one_hot_j).astype(np.float64).reshape((i1 - i0, bins, j1 - j0, bins)).transpose((0, 2, 1, 3))
+        count_xy /= float(prep.shape[0])
+        count_x = np.sum(count_xy, axis = 3)[..., np.newaxis]
+        count_y = np.sum(count_xy, axis = 2)[..., np.newaxis, :]
+        nonzero = count_xy > 0
+        mi = np.zeros_like(count_xy)
+        mi[nonzero] = count_xy[nonzero] * np.log(count_xy[nonzero] / (count_x * count_y)[nonzero])
+
+        return np.sum(mi, axis = (2, 3))
+
+    elif method == "CMIEQQ":
+        # joint (node, condition) labels of rows times node labels of columns give 
+        # 3D histograms of all pairs in tile as one matrix product
+        bins = 4
+        num_states = cond_states
+        one_hot_i = np.equal(prep[:, i0:i1, np.newaxis], np.arange(bins*num_states)).reshape((prep.shape[0], -1)).astype(np.float32)
+        one_hot_j = np.equal(prep[:, j0:j1, np.newaxis] // num_states, np.arange(bins)).reshape((prep.shape[0], -1)).astype(np.float32)
+        count_xyz = np.dot(one_hot_i.T, one_hot_j).astype(np.float64).reshape((i1 - i0, bins, num_states, j1 - j0, bins))
+        count_xyz /= float(prep.shape[0])
+        count_xz = np.sum(count_xyz, axis = 4)[..., np.newaxis]
+        count_yz = np.sum(count_xyz, axis = 1)[:, np.newaxis, ...]
+        count_z = np.sum(count_xz, axis = 1)[:, np.newaxis, ...]
+        nonzero = count_xyz > 0
+        cmi = np.zeros_like(count_xyz)
+        cmi[nonzero] = count_xyz[nonzero] * np.log((count_z * count_xyz)[nonzero] / (count_xz * count_yz)[nonzero])
+
+        return np.sum(cmi, axis = (1, 2, 4))
+
+    elif method == "CMIGAU":
+        # Gaussian CMI from partial correlation
+        corr = np.dot(prep[:, i0:i1].T, prep[:, j0:j1])
+        return -0.5 * np.log(np.maximum(1 - np.power(corr, 2), np.finfo(prep.dtype).tiny))
+
+    else:
+        tile = np.zeros((i1 - i0, j1 - j0))
+        for i in range(i0, i1):
+            for j in range(max(i, j0) if i0 == j0 else j0, j1):
+                tile[i - i0, j - j0] = _get_pairwise_value(prep[:, i], prep[:, j], method)
+        if i0 == j0:
+            # diagonal tile -- only upper triangle was computed
+            tile = np.triu(tile) + np.triu(tile, 1).T
+
+        return tile
+
+
+
+def _get_sparse_rows(prep, i0, i1, method, tile_size, threshold, top_k, dtype = np.float64):
+    """
+    Computes rows i0:i1 of the adjacency matrix tile by tile and keeps only the links
+    with value above threshold and/or top_k strongest links per node (self-links excluded).
+    dtype is the precision of the row block.
+    Returns number of kept links per row, their column indices and values.
+    """
+
+    num_nodes = prep.shape[1]
+    rows = np.zeros((i1 - i0, num_nodes), dtype = dtype)
+    for j0 in range(0, num_nodes, tile_size):
+        j1 = min(j0 + tile_size, num_nodes)
+        rows[:, j0:j1] = _get_pairwise_tile(prep, i0, i1, j0, j1, method)
+    # exclude self-links
+    rows[np.arange(i1 - i0), np.arange(i0, i1)] = -np.inf
+
+    counts = np.zeros((i1 - i0,), dtype = np.int64)
+    indices = []
+    data = []
+    for i in range(i1 - i0):
+        if threshold is not None:
+            ndx = np.where(rows[i, :] > threshold)[0]
+        else:
+            ndx = np.where(np.isfinite(rows[i, :]))[0]
+        if top_k is not None and ndx.shape[0] > top_k:
+            ndx = ndx[np.argpartition(rows[i, ndx], -top_k)[-top_k:]]
+        ndx.sort()
+        counts[i] = ndx.shape[0]
+        indices.append(ndx)
+        data.append(rows[i, ndx])
+
+    return counts, np.concatenate(indices), np.concatenate(data)
+
+
+
+def _process_sparse_rows(field_raw, field_shape, field_dtype, method, tile_size, threshold, top_k, dtype, jobq, resq):
+    """
+    Worker for sparse pairwise computation on shared memory. Gets row block
+    from jobq and puts only the kept links to resq.
+    """
+
+    prep = np.frombuffer(field_raw, dtype = field_dtype, count = int(np.prod(field_shape))).reshape(field_shape)
+
+    while True:
+        a = jobq.get() # get queued row block
+
+        if a is None: # if it is None, we are finished
+            break
+        else:
+            i0, i1 = a
+            resq.put((i0, _get_sparse_rows(prep, i0, i1, method, tile_size, threshold, top_k, dtype)))
+
+
+
+def _get_shared_array(shape, dtype):
+    """
+    Allocates zeroed array in shared memory. Returns the raw shared buffer 
+    (to be passed to worker processes) and numpy view on it.
+    """
+
+    size = int(np.prod(shape))
+    raw = mp.RawArray('b', max(size * np.dtype(dtype).itemsize, 1))
+
+    return raw, np.frombuffer(raw, dtype = dtype, count = size).reshape(shape)
+
+
+
+def _to_shared_array(arr):
+    """
+    Copies the array into shared memory. Returns the raw shared buffer 
+    (to be passed to worker processes) and numpy view on it.
+    """
+
+    raw, shared = _get_shared_array(arr.shape, arr.dtype)
+    shared[:] = arr
+
+    return raw, shared
+
+
+
+def _process_tiles(field_raw, field_shape, field_dtype, adj_raw, adj_dtype, method, cond_states, jobq, resq):
+    """
+    Worker for pairwise computation on shared memory. Gets tile coordinates
+    from jobq, reads the data from shared field and writes the result directly
+    to shared adjacency matrix. Puts the tile back to resq when done.
+    """
+
+    prep = np.frombuffer(field_raw, dtype = field_dtype, count = int(np.prod(field_shape))).reshape(field_shape)
+    adj = np.frombuffer(adj_raw, dtype = adj_dtype, count = field_shape[1]**2).reshape((field_shape[1], field_shape[1]))
+
+    while True:
+        a = jobq.get() # get queued tile
+
+        if a is None: # if it is None, we are finished
+            break
+        else:
+            i0, i1, j0, j1 = a
+            tile = _get_pairwise_tile(prep, i0, i1, j0, j1, method, cond_states)
+            adj[i0:i1, j0:j1] = tile
+            adj[j0:j1, i0:i1] = tile.T
+            resq.put(a)
+
+
+
 def _get_automutual_info(a):
     """
     Gets automutual information function.
@@ -213,21 +606,10 @@ class ScaleSpecificNetwork(DataField):
     def get_continuous_phase(self, pool = None):
         """
         Transforms phase from wavelet to continuous, increasing.
+        The whole field is transformed at once, pool is not used.
         """
 
-        if pool is None:
-            map_func = map
-        elif pool is not None:
-            map_func = pool.map
-
-        job_args = [ (i, j, self.phase[:, i, j]) for i in range(self.num_lats) for j in range(self.num_lons) ]
-        job_result = map_func(_get_continuous_phase, job_args)
-        del job_args
-
-        for i, j, res in job_result:
-            self.phase[:, i, j] = res
-
-        del job_result
+        self.phase = _get_continuous_phase(self.phase)
 
 
     def get_automutualinf(self, endpoint, pool = None):
@@ -259,6 +641,7 @@ class ScaleSpecificNetwork(DataField):
     def get_phase_fluctuations(self, rewrite = True, pool = None):
         """
         Gets phase fluctuations.
+        The whole field is computed at once, pool is not used.
         """
 
         self.get_continuous_phase(pool = pool)
@@ -268,25 +651,11 @@ class ScaleSpecificNetwork(DataField):
         elif self.sampling == 'daily':
             omega = 2 * np.pi / self.frequency
 
-        if pool is None:
-            map_func = map
-        elif pool is not None:
-            map_func = pool.map
-
-        job_args = [ (i, j, omega, self.phase[:, i, j]) for i in range(self.num_lats) for j in range(self.num_lons) ]
-        job_result = map_func(_get_phase_fluctuations, job_args)
-        del job_args
-
-        self.phase_fluctuations = np.zeros_like(self.phase)
-        
-        for i, j, res in job_result:
-            self.phase_fluctuations[:, i, j] = res
+        self.phase_fluctuations = _get_phase_fluctuations(self.phase, omega)
 
         if rewrite:
             self.phase = self.phase_fluctuations.copy()
 
-        del job_result
-
 
 
     def _process_matrix(self, jobq, resq):
@@ -298,47 +667,7 @@ class ScaleSpecificNetwork(DataField):
                 break # break infinity cycle
             else:
                 i, j, ph1, ph2, method = a # compute stuff
-                if method == "MPC":
-                    # get phase diff
-                    diff = ph1 - ph2
-                    # compute mean phase coherence
-                    coh = np.power(np.mean(np.cos(diff)), 2) + np.power(np.mean(np.sin(diff)), 2)
-                    resq.put((i, j, coh))
-
-                elif method == "MIEQQ":
-                    resq.put((i, j, MI.mutual_information(ph1, ph2, algorithm = 'EQQ2', bins = 4, log2 = False)))
-
-                elif method == "MIKNN":
-                    resq.put((i, j, MI.knn_mutual_information(ph1, ph2, k = 32, dualtree = True)))
-
-                elif method == "MIGAU":
-                    corr = np.corrcoef([ph1, ph2])[0, 1]                    
-                    mi = -0.5 * np.log(1 - np.power(corr, 2)) if corr < 1. else 0
-                    resq.put((i, j, mi)) 
-
-                elif method == "COV":
-                    resq.put((i, j, np.cov(ph1, ph2, ddof = 1)[0,1]))
-
-                elif method == "CORR":
-                    resq.put((i, j, st.pearsonr(ph1, ph2)[0]))
-
-                elif method == "WCOH":
-                    # input field must be wave from wavelet!!!!
-                    w1 = np.complex(0, 0)
-                    w2 = w1; w3 = w1
-                    for t in range(0, self.time.shape[0]):
-                        w1 += ph1[t] * np.conjugate(ph2[t])
-                        w2 += ph1[t] * np.conjugate(ph1[t])
-                        w3 += ph2[t] * np.conjugate(ph2[t])
-                    w1 /= np.sqrt(np.abs(w2) * np.abs(w3))
-                    resq.put((i, j, np.abs(w1)))
-
-                elif method[0] == 'L':
-                    p = int(method[1])
-                    res = 0
-                    for t in range(ph1.shape[0]):
-                        res += np.power(np.abs(ph1[t] - ph2[t]), p)
-                    resq.put((i, j, np.power(res, 1./p)))
+                resq.put((i, j, _get_pairwise_value(ph1, ph2, method)))
 
 
     def _process_matrix_cond(self, jobq, resq):
@@ -354,7 +683,122 @@ class ScaleSpecificNetwork(DataField):
 
 
 
-    def get_adjacency_matrix(self, field, method = "MPC", pool = None, use_queue = True, num_workers = 0):
+    def _get_batched_adjacency_matrix(self, field, method, tile_size, num_workers = 0, dtype = np.float64, cond = None):
+        """
+        Computes the whole adjacency matrix in tiles of tile_size x tile_size
+        from the field transformed only once, so the memory stays bounded.
+        If num_workers > 0, the prepared field and the adjacency matrix live in shared
+        memory and workers receive only the tile coordinates.
+        cond is the condition for conditioned methods (CMIEQQ, CMIGAU).
+        """
+
+        prep = _prepare_pairwise_field(field, method, dtype = dtype, cond = cond)
+        cond_states = _get_num_cond_states(cond) if cond is not None else None
+        tile_size = _get_hist_tile_size(tile_size, method, cond_states, num_workers)
+        tiles = _get_tiles(field.shape[1], tile_size)
+
+        if num_workers == 0:
+            adj = np.zeros((field.shape[1], field.shape[1]), dtype = dtype)
+
+            for i0, i1, j0, j1 in tiles:
+                tile = _get_pairwise_tile(prep, i0, i1, j0, j1, method, cond_states)
+                adj[i0:i1, j0:j1] = tile
+                adj[j0:j1, i0:i1] = tile.T
+
+        else:
+            field_raw, _ = _to_shared_array(prep)
+            # RawArray is zeroed, so the matrix is filled in place without a temporary
+            adj_raw, adj = _get_shared_array((field.shape[1], field.shape[1]), dtype)
+
+            jobs = mp.Queue()
+            results = mp.Queue()
+
+            workers = [mp.Process(target = _process_tiles, args = (field_raw, prep.shape, prep.dtype, adj_raw, adj.dtype, method, cond_states, jobs, results)) 
+                        for i in range(num_workers)]
+            for w in workers:
+                w.start()
+
+            for tile in tiles:
+                jobs.put(tile)
+
+            # fill queue with None for workers to finish
+            for i in range(num_workers):
+                jobs.put(None)
+
+            for _ in range(len(tiles)):
+                results.get()
+
+            for w in workers:
+                w.join()
+
+            # the returned view keeps the shared buffer alive, no copy is made
+            del field_raw, adj_raw
+
+        del prep
+
+        return adj
+
+
+
+    def _get_sparse_adjacency_matrix(self, field, method, tile_size, threshold, top_k, num_workers = 0, dtype = np.float64):
+        """
+        Computes the adjacency matrix block of rows by block of rows and stores only 
+        the kept links in CSR sparse matrix, so the dense N x N matrix is never allocated.
+        If num_workers > 0, row blocks are computed by workers on shared memory field.
+        """
+
+        from scipy.sparse import csr_matrix
+
+        prep = _prepare_pairwise_field(field, method, dtype = dtype)
+        num_nodes = field.shape[1]
+        tile_size = _get_hist_tile_size(tile_size, method, num_workers = num_workers)
+        row_blocks = [ (i0, min(i0 + tile_size, num_nodes)) for i0 in range(0, num_nodes, tile_size) ]
+
+        if num_workers == 0:
+            job_results = [ (i0, _get_sparse_rows(prep, i0, i1, method, tile_size, threshold, top_k, dtype)) for i0, i1 in row_blocks ]
+
+        else:
+            field_raw, _ = _to_shared_array(prep)
+
+            jobs = mp.Queue()
+            results = mp.Queue()
+
+            workers = [mp.Process(target = _process_sparse_rows, args = (field_raw, prep.shape, prep.dtype, method, tile_size, 
+                        threshold, top_k, dtype, jobs, results)) for i in range(num_workers)]
+            for w in workers:
+                w.start()
+
+            for block in row_blocks:
+                jobs.put(block)
+
+            # fill queue with None for workers to finish
+            for i in range(num_workers):
+                jobs.put(None)
+
+            job_results = [ results.get() for _ in range(len(row_blocks)) ]
+
+            for w in workers:
+                w.join()
+
+            del field_raw
+
+        del prep
+
+        # assemble CSR structure in order of row blocks
+        job_results.sort(key = lambda res: res[0])
+        counts = np.concatenate([ res[1][0] for res in job_results ])
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        indices = np.concatenate([ res[1][1] for res in job_results ])
+        data = np.concatenate([ res[1][2] for res in job_results ]).astype(dtype)
+        del job_results
+
+        return csr_matrix((data, indices, indptr), shape = (num_nodes, num_nodes))
+
+
+
+    def get_adjacency_matrix(self, field, method = "MPC", pool = None, use_queue = True, num_workers = 0, 
+                                batched = True, tile_size = 1024, use_shared = False, dtype = np.float64, 
+                                threshold = None, top_k = None):
         """
         Gets the matrix of mean phase coherence between each two grid-points.
         Methods for adjacency matrix:
@@ -365,8 +809,23 @@ class ScaleSpecificNetwork(DataField):
             COV - covariance matrix
             WCOH - wavelet coherence
             L1 or L2 - Lp difference
+        If batched is True, methods which support it (MPC, WCOH, L1, L2, MIEQQ, MIGAU, CORR, COV) are computed for all pairs 
+            at once using matrix products in tiles of tile_size x tile_size pairs.
+        If use_shared is True, any method is computed by num_workers processes working
+            on tiles of the field stored in shared memory.
+        dtype sets the precision of batched computation and of the adjacency matrix, 
+            use np.float32 to halve the memory.
+        If threshold and/or top_k is set, only links with value above threshold and/or
+            top_k strongest links of each node are kept and the adjacency matrix is stored as
+            scipy.sparse CSR matrix (rows hold links of the node, with top_k the matrix is not 
+            necessarily symmetric).
         """
         
+        if method == "WCOH" and field.dtype != np.complex64:
+            raise Exception("Wavelet coherence requires input field to be wave data from wavelet!")
+        if method[0] == 'L' and int(method[1]) not in [1,2]:
+            raise Exception("Lp method shoud use p = 1 or 2")
+
         if method == "MPC":
             self.get_continuous_phase(pool = pool)
         
@@ -374,7 +833,18 @@ class ScaleSpecificNetwork(DataField):
 
         start = datetime.now()
 
-        if not use_queue:
+        if threshold is not None or top_k is not None:
+            self.adjacency_matrix = self._get_sparse_adjacency_matrix(field, method, tile_size, threshold, top_k, 
+                                            num_workers = num_workers if use_shared else 0, dtype = dtype)
+
+        elif use_shared or (batched and method in ["MPC", "WCOH", "L1", "L2", "MIEQQ", "MIGAU", "CORR", "COV"]):
+            self.adjacency_matrix = self._get_batched_adjacency_matrix(field, method, tile_size, 
+                                            num_workers = num_workers if use_shared else 0, dtype = dtype)
+
+            # nullify the diagonal 
+            np.fill_diagonal(self.adjacency_matrix, 0.)
+
+        elif not use_queue:
             self.adjacency_matrix = np.zeros((field.shape[1], field.shape[1]))
 
             if pool is None:
@@ -403,11 +873,6 @@ class ScaleSpecificNetwork(DataField):
 
         else:
 
-            if method == "WCOH" and field.dtype != np.complex64:
-                raise Exception("Wavelet coherence requires input field to be wave data from wavelet!")
-            if method[0] == 'L' and int(method[1]) not in [1,2]:
-                raise Exception("Lp method shoud use p = 1 or 2")
-
             jobs = mp.Queue()
             results = mp.Queue()
 
@@ -449,8 +914,32 @@ class ScaleSpecificNetwork(DataField):
         field = self.reshape_flat_field(field)
 
 
-    def get_adjacency_matrix_conditioned(self, cond_ts, use_queue = True, num_workers = 0):
+    def get_adjacency_matrix_conditioned(self, cond_ts, use_queue = True, num_workers = 0, method = "MIEQQ", 
+                                            batched = True, tile_size = 256, use_shared = False):
+        """
+        Gets the matrix of conditional mutual information between phases of each two grid-points
+        conditioned on cond_ts (1D time series or list of them).
+        Methods:
+            MIEQQ - equiquantal binning with 4 bins
+            MIGAU - Gaussian CMI from partial correlations (only batched)
+        If batched is True, the condition and nodes are binned only once and CMI for all pairs
+            is computed from 3D histograms obtained as matrix products in tiles of tile_size x tile_size 
+            pairs, the matrix is then symmetric. If use_shared is True, tiles are computed by num_workers 
+            processes on shared memory.
+        """
+
+        if batched or use_shared:
+            field = self.flatten_field(self.phase)
+            start = datetime.now()
+            self.adjacency_matrix = self._get_batched_adjacency_matrix(field, "C" + method, tile_size, 
+                                        num_workers = num_workers if use_shared else 0, cond = cond_ts)
+            np.fill_diagonal(self.adjacency_matrix, 0.)
+            print(datetime.now()-start)
 
+            return
+
+        if method != "MIEQQ":
+            raise Exception("Only MIEQQ method is supported for non-batched conditioned network.")
 
         self.phase = self.flatten_field(self.phase)
 
@@ -496,16 +985,114 @@ class ScaleSpecificNetwork(DataField):
         self.phase = self.reshape_flat_field(self.phase)
 
 
+    def get_adjacency_significance(self, surrs, num_surr, period, period_unit = 'y', cut = 1, method = "MIEQQ", 
+                                    field_name = 'phase', surr_type = 'FT', seasonality = None, pool = None, 
+                                    sig_level = 0.05, checkpoint = None, checkpoint_every = 10, **kwargs):
+        """
+        Tests the significance of the links in already computed adjacency matrix against surrogates.
+        For each of num_surr surrogates from surrs (SurrogateField with copied data, or prepared
+        AR surrogates) of type surr_type ('FT', 'AAFT', 'IAAFT', 'MF' or 'AR'), seasonality 
+        (mean, var, trend as from get_seasonality) is optionally returned, wavelet with period is
+        performed and adjacency matrix of field_name ('phase', 'amplitude' or 'wave') is computed
+        with method (other kwargs are passed to get_adjacency_matrix).
+        Surrogate matrices are not stored, only the running per-link exceedance counts, mean and
+        variance are kept. If checkpoint is a filename, the state is saved every checkpoint_every
+        surrogates and the computation is resumed from it, if it exists and was computed with
+        the same parameters.
+        Only dense adjacency matrices (computed without threshold and top_k) can be tested.
+        Returns p-values and significance (p-value < sig_level) matrices, mean and variance of 
+        surrogate links are stored as surr_mean and surr_var. Self-links have p-value 1.
+        """
+
+        import cPickle
+        import os
+        from scipy.sparse import issparse
+
+        if self.adjacency_matrix is None:
+            raise Exception("Compute the adjacency matrix of the data first!")
+        if issparse(self.adjacency_matrix) or kwargs.get('threshold') is not None or kwargs.get('top_k') is not None:
+            raise Exception("Significance can be tested only for dense adjacency matrix, compute it without threshold and top_k!")
+        if num_surr < 1:
+            raise Exception("At least one surrogate is needed for significance testing!")
+
+        data_adj = self.adjacency_matrix.copy()
+        orig_data = self.data.copy()
+        orig_fields = [self.phase, self.amplitude, self.wave]
+
+        # parameters the surrogate statistics depend on, checked when resuming from checkpoint
+        params = {'method' : method, 'field_name' : field_name, 'surr_type' : surr_type, 'period' : period, 
+                    'period_unit' : period_unit, 'cut' : cut, 'kwargs' : sorted(kwargs.items())}
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint, 'rb') as f:
+                state = cPickle.load(f)
+            if state['exceedances'].shape != data_adj.shape:
+                raise Exception("Checkpoint %s does not match the adjacency matrix!" % checkpoint)
+            if state.get('params') != params:
+                raise Exception("Checkpoint %s was computed with different parameters: %s" % (checkpoint, str(state.get('params'))))
+        else:
+            state = {'num_done' : 0, 'exceedances' : np.zeros(data_adj.shape, dtype = np.uint32),
+                        'mean' : np.zeros(data_adj.shape), 'M2' : np.zeros(data_adj.shape), 'params' : params}
+
+        for i in range(state['num_done'], num_surr):
+            print("surr %d/%d computing..." % (i+1, num_surr))
+
+            if surr_type in ['FT', 'AAFT', 'IAAFT']:
+                surrs.construct_fourier_surrogates(algorithm = surr_type, pool = pool)
+            elif surr_type == 'MF':
+                surrs.construct_multifractal_surrogates(pool = pool)
+            elif surr_type == 'AR':
+                surrs.construct_surrogates_with_residuals(pool = pool)
+            else:
+                raise Exception("Unknown surrogate type, please use 'FT', 'AAFT', 'IAAFT', 'MF' or 'AR'.")
+            if seasonality is not None:
+                surrs.add_seasonality(seasonality[0], seasonality[1], seasonality[2])
+
+            self.data = surrs.get_surr()
+            self.wavelet(period, period_unit, cut = cut, pool = pool, save_wave = (field_name == 'wave'))
+            self.get_adjacency_matrix(getattr(self, field_name), method = method, pool = pool, **kwargs)
+
+            # update running statistics -- exceedances as in get_p_vals and Welford's mean and variance
+            state['exceedances'] += np.greater_equal(data_adj, self.adjacency_matrix)
+            state['num_done'] = i + 1
+            delta = self.adjacency_matrix - state['mean']
+            state['mean'] += delta / state['num_done']
+            state['M2'] += delta * (self.adjacency_matrix - state['mean'])
+
+            if checkpoint is not None and (state['num_done'] % checkpoint_every == 0 or state['num_done'] == num_surr):
+                with open(checkpoint + ".tmp", 'wb') as f:
+                    cPickle.dump(state, f, protocol = cPickle.HIGHEST_PROTOCOL)
+                os.rename(checkpoint + ".tmp", checkpoint)
+
+        # return the data
+        self.data = orig_data
+        self.phase, self.amplitude, self.wave = orig_fields
+        self.adjacency_matrix = data_adj
+
+        self.surr_mean = state['mean']
+        self.surr_var = state['M2'] / (state['num_done'] - 1) if state['num_done'] > 1 else np.zeros_like(state['M2'])
+        p_vals = 1. - state['exceedances'] / float(state['num_done'])
+        # self-links are zeroed in data and all surrogates, they are never significant
+        np.fill_diagonal(p_vals, 1.)
+
+        return p_vals, p_vals < sig_level
+
+
+
     def save_net(self, fname, only_matrix = True):
         """
         Saves the scale specific network.
         If only_matrix is True, saves only adjacency_matrix, else saves the whole class.
+        Sparse adjacency matrix is saved directly as CSR matrix.
         """
 
         import cPickle
+        from scipy.sparse import issparse
 
         with open(fname, 'wb') as f:
-            if only_matrix:
+            if only_matrix and issparse(self.adjacency_matrix):
+                cPickle.dump({'adjacency_matrix' : self.adjacency_matrix.astype(np.float32)}, f, protocol = cPickle.HIGHEST_PROTOCOL)
+            elif only_matrix:
                 cPickle.dump({'adjacency_matrix' : self.adjacency_matrix.astype(np.float16)}, f, protocol = cPickle.HIGHEST_PROTOCOL)
             else:
                 cPickle.dump(self.__dict__, f, protocol = cPickle.HIGHEST_PROTOCOL)
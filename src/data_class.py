@@ -81,6 +81,44 @@ def nandetrend(arr, axis = 0):
     # return detrended data and linear coefficient
     
     return ret, m, c
+
+
+
+def get_continuous_phase(phase):
+    """
+    Transforms phase (time x any spatial dimensions) to continuous, increasing phase by adding
+    2*pi to the rest of the time series at every jump larger than 1. Returns new array.
+    """
+
+    jumps = np.greater(np.abs(np.diff(phase, axis = 0)), 1)
+    cont_phase = np.array(phase, copy = True)
+    cont_phase[1:, ...] += 2 * np.pi * np.cumsum(jumps, axis = 0)
+
+    return cont_phase
+
+
+
+def get_phase_fluctuations(phase, omega):
+    """
+    Returns phase fluctuations of phase (time x any spatial dimensions) as deviations
+    from stationary phase increasing with angular frequency omega
+        phase(t) - (phase(0) + omega*t)
+    """
+
+    t = np.arange(phase.shape[0]).reshape((-1,) + (1,)*(phase.ndim - 1))
+
+    return phase - (t * omega + phase[0, ...])
+
+
+
+def _column_chunks(num_cols, chunk_size = 4096):
+    """
+    Yields slices covering range(num_cols) by chunk_size, so that fields (time x space)
+    are processed by blocks of columns with bounded memory.
+    """
+
+    for start in range(0, num_cols, chunk_size):
+        yield slice(start, min(start + chunk_size, num_cols))
         
 
 
@@ -1285,7 +1323,7 @@ class DataField:
 
 
     def temporal_filter(self, cutoff, btype, ftype = 'butter', order = 2, cut = 1, pool = None, cut_time = False,
-        rp = None, rs = None, cut_data = False):
+        rp = None, rs = None, cut_data = False, mask_cut = False):
         """
         Filters data in temporal sense.
         Uses Butterworth filter of order order.
@@ -1304,9 +1342,13 @@ class DataField:
             ellip - for Cauer/elliptic filter
             bessel - for Bessel/Thomson filter
         cut in years
+        if mask_cut is True, filtered data keep full length as masked array with cut samples
+            masked (cut_time and cut_data are then ignored), otherwise they are written
+            already trimmed.
+        The whole field is filtered at once, so pool is not used.
         """
 
-        from scipy.signal import iirfilter
+        from scipy.signal import iirfilter, filtfilt
 
         delta = self.time[1] - self.time[0]
         if delta == 1:
@@ -1335,38 +1377,23 @@ class DataField:
         else:
             raise Exception("For band filter cutoff must be a list of [low,high] for low/high-pass cutoff must be a integer!")
 
-        if pool is None:
-            map_func = map
-        elif pool is not None:
-            map_func = pool.map
-
-        if self.data.ndim > 1:
-            num_lats = self.lats.shape[0]
-            num_lons = self.lons.shape[0]
-        else:
-            num_lats = 1
-            num_lons = 1
-            self.data = self.data[:, np.newaxis, np.newaxis]
+        num_tm = self.data.shape[0]
+        to_cut = int(y*cut) if cut is not None else 0
 
-        self.filtered_data = np.zeros_like(self.data)
+        bufs, views = self._get_trimmed_buffers([self.data.dtype], to_cut, mask_cut)
+        flat_data = np.reshape(self.data, (num_tm, -1))
+        for sl in _column_chunks(flat_data.shape[1]):
+            views[0][:, sl] = filtfilt(b, a, flat_data[:, sl], axis = 0)[to_cut : num_tm - to_cut]
 
-        job_args = [ (i, j, self.data[:, i, j], b, a) for i in range(num_lats) for j in range(num_lons) ]
-        job_result = map_func(self._get_filtered_data, job_args)
-        del job_args
-        for i, j, res in job_result:
-            self.filtered_data[:, i, j] = res
-
-        del job_result
+        self.filtered_data = self._shape_output(bufs[0], to_cut, mask_cut)
+        del bufs, views
+        self.data = np.squeeze(self.data)
 
-        if cut is not None:
-            to_cut = int(y*cut)
+        if to_cut > 0 and not mask_cut:
             if cut_time:
                 self.time = self.time[to_cut:-to_cut]
             if cut_data:
                 self.data = self.data[to_cut:-to_cut]
-
-        self.data = np.squeeze(self.data)
-        self.filtered_data = np.squeeze(self.filtered_data) if cut is None else np.squeeze(self.filtered_data[to_cut:-to_cut, ...])
         
 
 
@@ -1796,151 +1823,173 @@ class DataField:
 
 
     @staticmethod
-    def _get_oscillatory_modes(a):
+    def _get_oscillatory_modes(data, s0, k0, save_wave, amp_to_data, cont_ph, cut, out = None):
         """
-        Helper function for wavelet.
+        Helper function for wavelet. Computes phase and amplitude (and wave) of all
+        time series in data (time x space) by one batched wavelet transform.
+        Time series with NaNs give NaNs.
+        Results are trimmed by cut samples at both ends and written into out (list of
+        phase, amplitude (and wave) arrays), which is allocated if None.
         """
 
         import wavelet_analysis as wvlt
 
-        i, j, s0, data, flag, amp_to_data, k0, cont_ph, cut = a
-        if not np.any(np.isnan(data)):
-            wave, _, _, _ = wvlt.continous_wavelet(data, 1, True, wvlt.morlet, dj = 0, s0 = s0, j1 = 0, k0 = k0)
-            phase = np.arctan2(np.imag(wave), np.real(wave))[0, :]
-            amplitude = np.sqrt(np.power(np.real(wave),2) + np.power(np.imag(wave),2))[0, :]
-            if amp_to_data:
-                reconstruction = amplitude * np.cos(phase)
-                fit_x = np.vstack([reconstruction, np.ones(reconstruction.shape[0])]).T
-                m, c = np.linalg.lstsq(fit_x, data)[0]
-                amplitude = m * amplitude + c
-            if cut is not None:
-                phase = phase[cut:-cut]
-                amplitude = amplitude[cut:-cut]
-                wave = wave[0, cut:-cut]
-            if cont_ph:
-                for t in range(phase.shape[0] - 1):
-                    if np.abs(phase[t+1] - phase[t]) > 1:
-                        phase[t+1: ] += 2 * np.pi
-            
-            ret = [phase, amplitude]
-            if flag:
-                ret.append(wave)
-
-            return i, j, ret
+        num_tm = data.shape[0]
+        wave = wvlt.continous_wavelet_field(data, 1, True, wvlt.morlet, dj = 0, s0 = s0, j1 = 0, k0 = k0)[0][0, ...]
+        trimmed = wave[cut : num_tm - cut, ...]
+        if out is None:
+            out = [ np.zeros(trimmed.shape), np.zeros(trimmed.shape) ]
+            if save_wave:
+                out.append(np.zeros(trimmed.shape, dtype = np.complex128))
+
+        if amp_to_data:
+            phase = np.arctan2(np.imag(wave), np.real(wave))
+            amplitude = np.sqrt(np.power(np.real(wave),2) + np.power(np.imag(wave),2))
+            # least squares fit of data by m * reconstruction + c for every series
+            reconstruction = amplitude * np.cos(phase)
+            rec_anom = reconstruction - np.mean(reconstruction, axis = 0)
+            m = np.sum(rec_anom * (data - np.mean(data, axis = 0)), axis = 0) / np.sum(rec_anom * rec_anom, axis = 0)
+            c = np.mean(data, axis = 0) - m * np.mean(reconstruction, axis = 0)
+            out[0][:] = phase[cut : num_tm - cut, ...]
+            out[1][:] = m * amplitude[cut : num_tm - cut, ...] + c
         else:
-            if flag:
-                return i, j, [np.nan, np.nan, np.nan]
-            else:
-                return i, j, [np.nan, np.nan]
+            out[0][:] = np.arctan2(np.imag(trimmed), np.real(trimmed))
+            out[1][:] = np.sqrt(np.power(np.real(trimmed),2) + np.power(np.imag(trimmed),2))
+        if cont_ph:
+            out[0][:] = get_continuous_phase(out[0])
+        if save_wave:
+            out[2][:] = trimmed
+
+        return out
 
 
 
     @staticmethod
-    def _get_parametric_phase(a):
-        """
-        Helper function for parametric phase.
-        """
-
-        i, j, freq, data, window, flag, save_wave, cont_ph, cut = a
-        
-        if not np.any(np.isnan(data)):
-            half_length = int(np.floor(data.shape[0]/2))
-            upper_bound = half_length + 1 if data.shape[0] & 0x1 else half_length
-            # center data to zero mean (NOT climatologically)
-            data -= np.mean(data, axis = 0)
-            # compute smoothing wave from signal
-            c = np.cos(np.arange(-half_length, upper_bound, 1) * freq)
-            s = np.sin(np.arange(-half_length, upper_bound, 1) * freq)
-            cx = np.dot(c, data) / data.shape[0]
-            sx = np.dot(s, data) / data.shape[0]
-            mx = np.sqrt(cx**2 + sx**2)
-            phi = np.angle(cx - 1j*sx)
-            z = mx * np.cos(np.arange(-half_length, upper_bound, 1) * freq + phi)
-
-            # iterate with window
-            iphase = np.zeros_like(data)
-            half_window = int(np.floor(window/2))
-            upper_bound_window = half_window + 1 if window & 0x1 else half_window
-            co = np.cos(np.arange(-half_window, upper_bound_window, 1) *freq)
-            so = np.sin(np.arange(-half_window, upper_bound_window, 1) *freq)
-            
-            for shift in range(0, data.shape[0] - window + 1):
-                y = data[shift:shift + window].copy()
-                y -= np.mean(y)
-                cxo = np.dot(co, y) / window
-                sxo = np.dot(so, y) / window
-                phio = np.angle(cxo - 1j*sxo)
-                iphase[shift+half_window] = phio
-
-            iphase[shift+half_window+1:] = np.angle(np.exp(1j*(np.arange(1, upper_bound_window) * freq + phio)))
-            y = data[:window].copy()
-            y -= np.mean(y)
-            cxo = np.dot(co, y) / window
-            sxo = np.dot(so, y) / window
-            phio = np.angle(cxo - 1j*sxo)
-            iphase[:half_window] = np.angle(np.exp(1j*(np.arange(-half_window, 0, 1)*freq + phio)))
-            if cut is not None:
-                iphase = iphase[cut:-cut]
-                z = z[cut:-cut]
-            if cont_ph:
-                for t in range(iphase.shape[0] - 1):
-                    if np.abs(iphase[t+1] - iphase[t]) > 1:
-                        iphase[t+1: ] += 2 * np.pi
-            if flag:
-                sinusoid = np.arange(-half_length, upper_bound)*freq + phi
-                sinusoid = np.angle(np.exp(1j*sinusoid))
-                if cut is not None:
-                    sinusoid = sinusoid[cut:-cut]
-                iphase = np.angle(np.exp(1j*(iphase - sinusoid)))
-                iphase -= iphase[0]
-
-            ret = [iphase]
-            if save_wave:
-                ret.append(z)
+    def _get_parametric_phase(data, freq, window, flag, save_wave, cont_ph, cut, out = None):
+        """
+        Helper function for parametric phase. Computes phase (and smoothing wave) of all
+        time series in data (time x space) at once. Projections of all windows are obtained
+        from cumulative sums in O(1) per shift. Time series with NaNs give NaNs.
+        Results are trimmed by cut samples at both ends and written into out (list of
+        phase (and wave) arrays), which is allocated if None.
+        """
+
+        num_tm = data.shape[0]
+        valid = np.logical_not(np.any(np.isnan(data), axis = 0))
+        # center data to zero mean (NOT climatologically)
+        data = data[:, valid] - np.mean(data[:, valid], axis = 0)
 
-            return i, j, ret
-        
-        else:
-            if save_wave:
-                return i, j, [np.nan, np.nan]
-            else:
-                return i, j, [np.nan]
+        half_length = int(np.floor(num_tm/2))
+        upper_bound = half_length + 1 if num_tm & 0x1 else half_length
+        # compute smoothing wave from signal
+        tm = np.arange(-half_length, upper_bound, 1)[:, np.newaxis]
+        cx = np.dot(np.cos(tm[:, 0] * freq), data) / num_tm
+        sx = np.dot(np.sin(tm[:, 0] * freq), data) / num_tm
+        mx = np.sqrt(cx**2 + sx**2)
+        phi = np.angle(cx - 1j*sx)
+        z = mx * np.cos(tm * freq + phi)
 
+        # projections of every window data[shift:shift + window] (centered) on cos and sin
+        # centered in the window, as sums of data * exp(i*t*freq) rotated back by the window center
+        half_window = int(np.floor(window/2))
+        upper_bound_window = half_window + 1 if window & 0x1 else half_window
+        co = np.cos(np.arange(-half_window, upper_bound_window, 1) * freq)
+        so = np.sin(np.arange(-half_window, upper_bound_window, 1) * freq)
+        num_shifts = num_tm - window + 1
 
+        cum_sum = np.zeros((num_tm + 1, data.shape[1]), dtype = np.complex128)
+        cum_sum[1:] = np.cumsum(np.exp(1j * np.arange(num_tm) * freq)[:, np.newaxis] * data, axis = 0)
+        cum_data = np.zeros((num_tm + 1, data.shape[1]))
+        cum_data[1:] = np.cumsum(data, axis = 0)
+        window_sum = (cum_sum[window:] - cum_sum[:num_shifts]) * np.exp(-1j * (np.arange(num_shifts) + half_window) * freq)[:, np.newaxis]
+        window_mean = (cum_data[window:] - cum_data[:num_shifts]) / window
+        del cum_sum, cum_data
 
-    @staticmethod
-    def _get_filtered_data(arg):
+        cxo = (np.real(window_sum) - window_mean * np.sum(co)) / window
+        sxo = (np.imag(window_sum) - window_mean * np.sum(so)) / window
+        phio = np.angle(cxo - 1j*sxo)
+        del window_sum, window_mean
+
+        iphase = np.zeros((num_tm, data.shape[1]))
+        iphase[half_window : half_window + num_shifts] = phio
+        # edges are extrapolated with the phase of the first and last window
+        iphase[half_window + num_shifts:] = np.angle(np.exp(1j*(np.arange(1, upper_bound_window)[:, np.newaxis] * freq + phio[-1])))
+        iphase[:half_window] = np.angle(np.exp(1j*(np.arange(-half_window, 0, 1)[:, np.newaxis] * freq + phio[0])))
+        iphase = iphase[cut : num_tm - cut]
+        z = z[cut : num_tm - cut]
+        if cont_ph:
+            iphase = get_continuous_phase(iphase)
+        if flag:
+            sinusoid = tm * freq + phi
+            sinusoid = np.angle(np.exp(1j*sinusoid))
+            sinusoid = sinusoid[cut : num_tm - cut]
+            iphase = np.angle(np.exp(1j*(iphase - sinusoid)))
+            iphase -= iphase[0]
+
+        ret = [iphase]
+        if save_wave:
+            ret.append(z)
+        if out is None:
+            out = [ np.zeros((iphase.shape[0], valid.shape[0])) for _ in ret ]
+
+        for res, res_out in zip(ret, out):
+            res_out[:, valid] = res
+            # series with NaNs
+            res_out[:, np.logical_not(valid)] = np.nan
+
+        return out
+
+
+
+    def _get_trimmed_buffers(self, dtypes, to_cut, mask_cut):
         """
-        Helper function for temporal filtering.
+        Returns flattened (time x space) output buffers of dtypes for a field computed from data
+        with to_cut samples cut from both ends, and views into them where the results go.
+        If mask_cut, buffers have full length and the cut samples are left out, otherwise
+        buffers are already trimmed.
         """
 
-        from scipy.signal import filtfilt
+        num_tm = self.data.shape[0]
+        num_pts = int(np.prod(self.data.shape[1:]))
+        length = num_tm if mask_cut else num_tm - 2*to_cut
+        bufs = [ np.zeros((length, num_pts), dtype = dtype) for dtype in dtypes ]
+        views = [ buf[to_cut : num_tm - to_cut] for buf in bufs ] if mask_cut else bufs
 
-        i, j, data, b, a = arg
+        return bufs, views
 
-        return i, j, filtfilt(b, a, data)
 
 
+    def _shape_output(self, buf, to_cut, mask_cut):
+        """
+        Returns flattened output buffer as time x spatial dims of data, without copying.
+        Singleton dimensions are squeezed, as for data itself.
+        If mask_cut, it is a masked array with to_cut samples masked at both ends.
+        """
 
-    def get_parametric_phase(self, period, window, period_unit = 'y', cut = 1, ts = None, pool = None, 
-                                    phase_fluct = False, save_wave = False, cut_time = False, 
-                                    continuous_phase = False, cut_data = False):
+        out = np.squeeze(np.reshape(buf, (buf.shape[0],) + self.data.shape[1:]))
+        if mask_cut:
+            mask = np.zeros(out.shape, dtype = np.bool_)
+            mask[:to_cut, ...] = True
+            mask[out.shape[0] - to_cut:, ...] = True
+            out = np.ma.masked_array(out, mask = mask)
+
+        return out
+
+
+
+    def _get_samples_per_unit(self, period_unit):
         """
-        Computes phase of analytic signal using parametric method.
-        Period is frequency in years, or days.
-        if ts is None, use self.data as input time series.
-        cut is either None or number period to be cut from beginning and end of the time series in years
-        if phase_fluct if False, computes only phase, otherwise also phase fluctuations from stationary 
-            sinusoid and returns this instead of phase - used for phase fluctuations
+        Returns number of time samples in one period unit ('y', 'm' or 'd')
+        according to temporal sampling of the field.
         """
 
         delta = self.time[1] - self.time[0]
         if delta == 1:
             # daily data
             if period_unit == 'y':
-                y = 365.25
+                return 365.25
             elif period_unit == 'd':
-                y = 1.
+                return 1.
             elif period_unit == 'm':
                 raise Exception("For daily data is hard to enter wavelet period in months...")
             else:
@@ -1948,9 +1997,9 @@ class DataField:
         elif abs(delta - 30) < 3.0:
             # monthly data
             if period_unit == 'y':
-                y = 12.
+                return 12.
             elif period_unit == 'm':
-                y = 1.
+                return 1.
             elif period_unit == 'd':
                 raise Exception("For monthly data doesn't make sense to enter wavelet period in days.")
             else:
@@ -1958,7 +2007,7 @@ class DataField:
         elif delta == 365 or delta == 366:
             # annual data
             if period_unit == 'y':
-                y = 1.
+                return 1.
             elif period_unit == 'm':
                 raise Exception("For monthly data doesn't make sense to enter wavelet period in days.")
             elif period_unit == 'd':
@@ -1968,107 +2017,73 @@ class DataField:
         else:
             raise Exception('Unknown temporal sampling in the field.')
 
-        self.frequency = 2*np.pi / (y*period) # frequency of interest
-        window = int(y*window)
 
-        if cut is not None:
-            to_cut = int(y*cut)
-        else:
-            to_cut = None
-
-        if ts is None:
-
-            if self.data.ndim > 2:
-                num_lats = self.lats.shape[0]
-                num_lons = self.lons.shape[0]
-            elif self.data.ndim == 2: # lot of station data
-                num_lats = self.lats.shape[0]
-                num_lons = 1
-                self.data = self.data[:, :, np.newaxis]
-            else:
-                num_lats = 1
-                num_lons = 1
-                self.data = self.data[:, np.newaxis, np.newaxis]
 
-            self.phase = np.zeros_like(self.data) if cut is None else np.zeros([self.data.shape[0] - 2*to_cut] + self.get_spatial_dims())
-            if save_wave:
-                self.wave = np.zeros_like(self.data, dtype = np.complex64) if cut is None else np.zeros([self.data.shape[0] - 2*to_cut] + self.get_spatial_dims(), dtype = np.complex64)
+    def get_parametric_phase(self, period, window, period_unit = 'y', cut = 1, ts = None, pool = None, 
+                                    phase_fluct = False, save_wave = False, cut_time = False, 
+                                    continuous_phase = False, cut_data = False, mask_cut = False):
+        """
+        Computes phase of analytic signal using parametric method.
+        Period is frequency in years, or days.
+        if ts is None, use self.data as input time series.
+        cut is either None or number period to be cut from beginning and end of the time series in years
+        if phase_fluct if False, computes only phase, otherwise also phase fluctuations from stationary 
+            sinusoid and returns this instead of phase - used for phase fluctuations
+        if mask_cut is True, outputs keep full length as masked arrays with cut samples masked
+            (cut_time and cut_data are then ignored), otherwise they are written already trimmed.
+        The whole field is computed at once, so pool is not used.
+        """
 
+        y = self._get_samples_per_unit(period_unit)
 
-            job_args = [ (i, j, self.frequency, self.data[:, i, j].copy(), window, phase_fluct, save_wave, continuous_phase, to_cut) for i in range(num_lats) for j in range(num_lons) ]
-            
-            if pool is None:
-                job_result = map(self._get_parametric_phase, job_args)
-            elif pool is not None:
-                job_result = pool.map(self._get_parametric_phase, job_args)
-            del job_args
-            
-            for i, j, res in job_result:
-                self.phase[:, i, j] = res[0]
-                if save_wave:
-                    self.wave[:, i, j] = res[1]
+        self.frequency = 2*np.pi / (y*period) # frequency of interest
+        window = int(y*window)
 
-            del job_result
+        if cut == 'coi':
+            raise Exception("Cut by cone of influence is available only for wavelet.")
+        to_cut = int(y*cut) if cut is not None else 0
 
-            if cut_time and cut is not None:
-                self.time = self.time[to_cut:-to_cut]
-            if cut is not None and cut_data:
-                self.data = self.data[to_cut:-to_cut, ...]
+        if ts is None:
+            bufs, views = self._get_trimmed_buffers([np.float64] + ([np.complex64] if save_wave else []), to_cut, mask_cut)
+            flat_data = np.reshape(self.data, (self.data.shape[0], -1))
+            for sl in _column_chunks(flat_data.shape[1]):
+                self._get_parametric_phase(flat_data[:, sl], self.frequency, window, phase_fluct, save_wave, 
+                                            continuous_phase, to_cut, out = [ view[:, sl] for view in views ])
 
-            self.data = np.squeeze(self.data)
-            self.phase = np.squeeze(self.phase)# if cut is None else np.squeeze(self.phase[to_cut:-to_cut, ...])
+            self.phase = self._shape_output(bufs[0], to_cut, mask_cut)
             if save_wave:
-                self.wave = np.squeeze(self.wave)# if cut is None else np.squeeze(self.wave[to_cut:-to_cut, ...])
+                self.wave = self._shape_output(bufs[1], to_cut, mask_cut)
+            del bufs, views
+            self.data = np.squeeze(self.data)
+
+            if to_cut > 0 and not mask_cut:
+                if cut_time:
+                    self.time = self.time[to_cut:-to_cut]
+                if cut_data:
+                    self.data = self.data[to_cut:-to_cut, ...]
             
         else:
-            res = self._get_parametric_phase([0, 0, self.frequency, ts.copy(), window, phase_fluct, save_wave, continuous_phase, to_cut])[-1]
+            res = [ r[:, 0] for r in self._get_parametric_phase(ts[:, np.newaxis], self.frequency, window, phase_fluct, 
+                                                                        save_wave, continuous_phase, to_cut) ]
             return res
 
 
 
     def wavelet(self, period, period_unit = 'y', cut = 1, ts = None, pool = None, save_wave = False, 
                     regress_amp_to_data = False, k0 = 6., cut_time = False, continuous_phase = False, 
-                    phase_fluct = False, cut_data = False):
+                    phase_fluct = False, cut_data = False, mask_cut = False):
         """
         Permforms wavelet transformation on data.
         Period is central wavelet period in years, or days.
         if ts is None, use self.data as input time series.
-        cut is either None or number period to be cut from beginning and end of the time series in years
+        cut is either None or number period to be cut from beginning and end of the time series in years,
+            or 'coi' to cut the parts inside the cone of influence of the period
+        if mask_cut is True, outputs keep full length as masked arrays with cut samples masked
+            (cut_time and cut_data are then ignored), otherwise they are written already trimmed.
+        The whole field is transformed at once, so pool is not used.
         """
 
-        delta = self.time[1] - self.time[0]
-        if delta == 1:
-            # daily data
-            if period_unit == 'y':
-                y = 365.25
-            elif period_unit == 'd':
-                y = 1.
-            elif period_unit == 'm':
-                raise Exception("For daily data is hard to enter wavelet period in months...")
-            else:
-                raise Exception("Unknown type.")
-        elif abs(delta - 30) < 3.0:
-            # monthly data
-            if period_unit == 'y':
-                y = 12.
-            elif period_unit == 'm':
-                y = 1.
-            elif period_unit == 'd':
-                raise Exception("For monthly data doesn't make sense to enter wavelet period in days.")
-            else:
-                raise Exception("Unknown type.")
-        elif delta == 365 or delta == 366:
-            # annual data
-            if period_unit == 'y':
-                y = 1.
-            elif period_unit == 'm':
-                raise Exception("For monthly data doesn't make sense to enter wavelet period in days.")
-            elif period_unit == 'd':
-                raise Exception("For monthly data doesn't make sense to enter wavelet period in days.")
-            else:
-                raise Exception("Unknown type.")
-        else:
-            raise Exception('Unknown temporal sampling in the field.')
+        y = self._get_samples_per_unit(period_unit)
 
         fourier_factor = (4 * np.pi) / (k0 + np.sqrt(2 + np.power(k0,2)))
         per = period * y # frequency of interest
@@ -2079,68 +2094,96 @@ class DataField:
         if phase_fluct:
             continuous_phase = True
 
-        if cut is not None:
-            to_cut = int(y*cut)
+        if cut == 'coi':
+            import wavelet_analysis as wvlt
+            to_cut = wvlt.get_coi_cut(self.data.shape[0] if ts is None else ts.shape[0], 1, per, wvlt.morlet, k0)
         else:
-            to_cut = None
+            to_cut = int(y*cut) if cut is not None else 0
 
         if ts is None:
+            bufs, views = self._get_trimmed_buffers([np.float64, np.float64] + ([np.complex64] if save_wave else []), to_cut, mask_cut)
+            flat_data = np.reshape(self.data, (self.data.shape[0], -1))
+            for sl in _column_chunks(flat_data.shape[1]):
+                self._get_oscillatory_modes(flat_data[:, sl], s0, k0, save_wave, regress_amp_to_data, continuous_phase, 
+                                            to_cut, out = [ view[:, sl] for view in views ])
+            if phase_fluct:
+                views[0][:] = get_phase_fluctuations(views[0], self.omega)
 
-            if self.data.ndim > 2:
-                num_lats = self.lats.shape[0]
-                num_lons = self.lons.shape[0]
-            elif self.data.ndim == 2: # lot of station data
-                num_lats = self.lats.shape[0]
-                num_lons = 1
-                self.data = self.data[:, :, np.newaxis]
-            else:
-                num_lats = 1
-                num_lons = 1
-                self.data = self.data[:, np.newaxis, np.newaxis]
-
-            self.phase = np.zeros_like(self.data) if cut is None else np.zeros([self.data.shape[0] - 2*to_cut] + self.get_spatial_dims())
-            self.amplitude = np.zeros_like(self.data) if cut is None else np.zeros([self.data.shape[0] - 2*to_cut] + self.get_spatial_dims())
+            self.phase = self._shape_output(bufs[0], to_cut, mask_cut)
+            self.amplitude = self._shape_output(bufs[1], to_cut, mask_cut)
             if save_wave:
-                self.wave = np.zeros_like(self.data, dtype = np.complex64) if cut is None else np.zeros([self.data.shape[0] - 2*to_cut] + self.get_spatial_dims(), dtype = np.complex64)
+                self.wave = self._shape_output(bufs[2], to_cut, mask_cut)
+            del bufs, views
+            self.data = np.squeeze(self.data)
 
-            job_args = [ (i, j, s0, self.data[:, i, j], save_wave, regress_amp_to_data, k0, continuous_phase, to_cut) for i in range(num_lats) for j in range(num_lons) ]
-            
-            if pool is None:
-                job_result = map(self._get_oscillatory_modes, job_args)
-            elif pool is not None:
-                job_result = pool.map(self._get_oscillatory_modes, job_args)
-            del job_args
-            
-            for i, j, res in job_result:
-                self.phase[:, i, j] = res[0]
-                self.amplitude[:, i, j] = res[1]
-                if save_wave:
-                    self.wave[:, i, j] = res[2]
+            if to_cut > 0 and not mask_cut:
+                if cut_time:
+                    self.time = self.time[to_cut:-to_cut]
+                if cut_data:
+                    self.data = self.data[to_cut:-to_cut, ...]
+        
+        else:
+            res = [ r[:, 0] for r in self._get_oscillatory_modes(ts[:, np.newaxis], s0, k0, save_wave, regress_amp_to_data, 
+                                                                        continuous_phase, to_cut) ]
+            return res
 
-            del job_result
 
-            if cut is not None and cut_time:
-                self.time = self.time[to_cut:-to_cut]
 
-            if cut is not None and cut_data:
-                self.data = self.data[to_cut:-to_cut, ...]
+    def wavelet_multi(self, periods, period_unit = 'y', cut = 1, k0 = 6., save_wave = False, 
+                        dtype = np.float64, chunk_size = 4096, out_fname = None):
+        """
+        Performs wavelet transformation on data for all periods at once.
+        Periods are central wavelet periods in years, or days.
+        cut is either None or number period to be cut from beginning and end of the time series in years,
+            or 'coi' to cut the parts inside the cone of influence of the longest period
+        Forward FFT of every time series is computed only once for all periods, the field is processed
+        in chunks of chunk_size grid points to keep memory bounded.
+        dtype sets the precision of outputs (np.float32 halves the memory, wave is then complex64).
+        If out_fname is given, outputs are numpy memmaps saved as out_fname + '_phase.npy',
+        '_amplitude.npy' and '_wave.npy'.
+        Returns phase and amplitude (and wave if save_wave) as periods x time x spatial dims cubes.
+        """
 
-            self.data = np.squeeze(self.data)
-            if phase_fluct:
-                ph0 = self.phase[0, ...]
-                sin = np.arange(0, self.phase.shape[0])[:, np.newaxis, np.newaxis] * self.omega + ph0
-                self.phase -= sin
-                self.phase = np.squeeze(self.phase)
-            else:
-                self.phase = np.squeeze(self.phase)
-            self.amplitude = np.squeeze(self.amplitude)
-            if save_wave:
-                self.wave = np.squeeze(self.wave)
-        
+        import wavelet_analysis as wvlt
+
+        y = self._get_samples_per_unit(period_unit)
+        fourier_factor = (4 * np.pi) / (k0 + np.sqrt(2 + np.power(k0,2)))
+        scales = np.atleast_1d(periods) * y / fourier_factor
+
+        num_tm = self.data.shape[0]
+        if cut == 'coi':
+            to_cut = wvlt.get_coi_cut(num_tm, 1, np.max(periods) * y, wvlt.morlet, k0)
         else:
-            res = self._get_oscillatory_modes([0, 0, s0, ts, save_wave, regress_amp_to_data, k0, continuous_phase, to_cut])[-1]
-            # add phase fluct!!!
-            return res
+            to_cut = int(y*cut) if cut is not None else 0
+        shape = (scales.shape[0], num_tm - 2*to_cut) + self.data.shape[1:]
+        cdtype = np.complex64 if dtype == np.float32 else np.complex128
+
+        outputs = [('phase', dtype), ('amplitude', dtype)]
+        if save_wave:
+            outputs.append(('wave', cdtype))
+        if out_fname is None:
+            cubes = [ np.zeros(shape, dtype = out_dtype) for _, out_dtype in outputs ]
+        else:
+            cubes = [ np.lib.format.open_memmap(out_fname + '_' + name + '.npy', mode = 'w+', dtype = out_dtype, shape = shape) 
+                        for name, out_dtype in outputs ]
+
+        flat_data = np.reshape(self.data, (num_tm, -1))
+        flat_cubes = [ np.reshape(cube, (shape[0], shape[1], -1)) for cube in cubes ]
+        for start in range(0, flat_data.shape[1], chunk_size):
+            sl = slice(start, min(start + chunk_size, flat_data.shape[1]))
+            wave = wvlt.continous_wavelet_field(flat_data[:, sl], 1, True, wvlt.morlet, scales = scales, k0 = k0)[0]
+            wave = wave[:, to_cut : num_tm - to_cut, :]
+            flat_cubes[0][:, :, sl] = np.arctan2(np.imag(wave), np.real(wave))
+            flat_cubes[1][:, :, sl] = np.sqrt(np.power(np.real(wave),2) + np.power(np.imag(wave),2))
+            if save_wave:
+                flat_cubes[2][:, :, sl] = wave
+            del wave
+
+        if out_fname is not None:
+            for cube in cubes:
+                cube.flush()
+
+        return tuple(cubes)
 
 
 
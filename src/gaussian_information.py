@@ -0,0 +1,151 @@
+"""
+Information-theoretic measures under Gaussian assumption. The covariance matrix of all variables
+(e.g. all nodes, their lags, conditions and surrogates) is computed only once, mutual information,
+conditional mutual information and transfer entropy of any subsets of variables are then obtained
+from log-determinants of its sub-blocks, batched over many subsets at once.
+Subsets of variables are given as indices into the covariance matrix:
+    int - one variable
+    1D array - batch of one-dimensional variables
+    2D array (num_subsets x dim) - batch of multi-dimensional variables
+Batches of different arguments are broadcast against each other, so e.g. one condition can be
+used for all pairs. Results are arrays with one value per subset, in nats unless log2 is True.
+"""
+
+import numpy as np
+
+
+CHUNK_SIZE = 2**16
+
+
+
+def get_covariance(data, lags = None, ddof = 1):
+    """
+    Returns covariance matrix of data (variables x time, or list of time series).
+    If lags (list of non-negative ints) is given, every variable is taken at every lag, so that
+    variable v delayed by lags[l] has index v*len(lags) + l (see lagged_index) and all lagged series
+    are cut to common length.
+    """
+
+    data = np.atleast_2d(np.array(data, dtype = np.float64))
+
+    if lags is not None:
+        max_lag = max(lags)
+        num_tm = data.shape[1] - max_lag
+        data = np.concatenate([ data[:, np.newaxis, max_lag - lag : max_lag - lag + num_tm] for lag in lags ], axis = 1)
+        data = data.reshape((-1, num_tm))
+
+    data = data - np.mean(data, axis = 1)[:, np.newaxis]
+
+    return np.dot(data, data.T) / float(data.shape[1] - ddof)
+
+
+
+def lagged_index(variables, lag_indices, num_lags):
+    """
+    Returns index of variable(s) at lag(s) given by their position in lags in the covariance
+    matrix from get_covariance with num_lags lags.
+    """
+
+    return np.asarray(variables) * num_lags + np.asarray(lag_indices)
+
+
+
+def _get_subsets(*idx):
+    """
+    Returns index subsets as 2D arrays (num_subsets x dim) broadcast to the same number of subsets.
+    """
+
+    subsets = []
+    for ndx in idx:
+        ndx = np.asarray(ndx, dtype = np.intp)
+        if ndx.ndim == 0:
+            ndx = ndx.reshape((1, 1))
+        elif ndx.ndim == 1:
+            ndx = ndx[:, np.newaxis]
+        subsets.append(ndx)
+
+    num_subsets = max([ ndx.shape[0] for ndx in subsets ])
+    for i, ndx in enumerate(subsets):
+        if ndx.shape[0] not in [1, num_subsets]:
+            raise Exception("Batches of variables must have the same number of subsets or only one.")
+        subsets[i] = np.broadcast_to(ndx, (num_subsets, ndx.shape[1]))
+
+    return subsets
+
+
+
+def _logdet(cov, subsets, chunk_size = CHUNK_SIZE):
+    """
+    Returns log-determinants of sub-blocks of cov given by subsets (num_subsets x dim).
+    Every distinct subset is evaluated only once, by batched Cholesky decomposition in chunks.
+    Singular (or not positive definite) sub-blocks give -inf.
+    """
+
+    if subsets.shape[1] == 0:
+        return np.zeros((subsets.shape[0],))
+
+    unique, inverse = np.unique(subsets, axis = 0, return_inverse = True)
+    logdet = np.zeros((unique.shape[0],))
+    for start in range(0, unique.shape[0], chunk_size):
+        ndx = unique[start : start + chunk_size]
+        blocks = cov[ndx[:, :, np.newaxis], ndx[:, np.newaxis, :]]
+        try:
+            chol = np.linalg.cholesky(blocks)
+            logdet[start : start + chunk_size] = 2 * np.sum(np.log(np.diagonal(chol, axis1 = 1, axis2 = 2)), axis = 1)
+        except np.linalg.LinAlgError:
+            # some block in the chunk is not positive definite
+            sign, ld = np.linalg.slogdet(blocks)
+            logdet[start : start + chunk_size] = np.where(sign > 0, ld, -np.inf)
+
+    return logdet[np.reshape(inverse, (-1,))]
+
+
+
+def entropy(cov, x, log2 = False):
+    """
+    Returns differential entropy of Gaussian variables x
+        H(x) = 0.5 * ( dim * log(2*pi*e) + log det cov_x )
+    """
+
+    x, = _get_subsets(x)
+    h = 0.5 * (x.shape[1] * np.log(2 * np.pi * np.e) + _logdet(cov, x))
+
+    return h / np.log(2) if log2 else h
+
+
+
+def mutual_information(cov, x, y, log2 = False):
+    """
+    Returns mutual information between Gaussian variables x and y
+        I(x; y) = 0.5 * ( log det cov_x + log det cov_y - log det cov_xy )
+    """
+
+    x, y = _get_subsets(x, y)
+    mi = 0.5 * (_logdet(cov, x) + _logdet(cov, y) - _logdet(cov, np.hstack([x, y])))
+
+    return mi / np.log(2) if log2 else mi
+
+
+
+def cond_mutual_information(cov, x, y, z, log2 = False):
+    """
+    Returns conditional mutual information between Gaussian variables x and y conditioned on z
+        I(x; y | z) = 0.5 * ( log det cov_xz + log det cov_yz - log det cov_z - log det cov_xyz )
+    """
+
+    x, y, z = _get_subsets(x, y, z)
+    cmi = 0.5 * (_logdet(cov, np.hstack([x, z])) + _logdet(cov, np.hstack([y, z]))
+                    - _logdet(cov, z) - _logdet(cov, np.hstack([x, y, z])))
+
+    return cmi / np.log(2) if log2 else cmi
+
+
+
+def transfer_entropy(cov, source_past, target, target_past, log2 = False):
+    """
+    Returns transfer entropy from source to target as conditional mutual information
+        T(source -> target) = I(source_past; target | target_past)
+    with indices of lagged variables, e.g. from lagged_index with covariance of lagged data.
+    """
+
+    return cond_mutual_information(cov, source_past, target, target_past, log2 = log2)
@@ -1,6 +1,6 @@
 import numpy as np
 from scipy import special, spatial
-from mutual_information import knn_cond_mutual_information, get_time_series_condition
+from mutual_information import knn_cond_mutual_information, get_time_series_condition, get_neighbours_within_eps
 
 class Chain_of_Rosslers():
 
@@ -40,7 +40,7 @@ class Chain_of_Rosslers():
 
 
 def _estimate_cmi_knn(array, k, xyz, standardize=True,
-                      verbosity=0):
+                      verbosity=0, num_threads=0):
     """Returns CMI estimate as described in Frenzel and Pompe PRL (2007).
     Args:
         array (array, optional): Data array of shape (dim, T).
@@ -48,11 +48,14 @@ def _estimate_cmi_knn(array, k, xyz, standardize=True,
         standardize (bool, optional): Whether to standardize data before.
         k (int): Number of nearest neighbors in joint space.
         verbosity (int, optional): Level of verbosity.
+        num_threads (int, optional): Number of threads for neighbour counting,
+            all cores if <= 0.
     Returns:
         TYPE: Description
     """
     k_xz, k_yz, k_z = _get_nearest_neighbors(array=array, xyz=xyz,
-                                             k=k, standardize=standardize)
+                                             k=k, standardize=standardize,
+                                             num_threads=num_threads)
 
     ixy_z = special.digamma(k) - (special.digamma(k_xz) +
                                   special.digamma(k_yz) -
@@ -62,7 +65,7 @@ def _estimate_cmi_knn(array, k, xyz, standardize=True,
 
 
 
-def _get_nearest_neighbors(array, xyz, k, standardize=True):
+def _get_nearest_neighbors(array, xyz, k, standardize=True, num_threads=0):
     """Returns nearest neighbors according to Frenzel and Pompe (2007).
     Retrieves the distances eps to the k-th nearest neighbors for every sample
     in joint space XYZ and returns the numbers of nearest neighbors within eps
@@ -72,20 +75,14 @@ def _get_nearest_neighbors(array, xyz, k, standardize=True):
         xyz (array): XYZ identifier array of shape (dim,).
         k (int): Number of nearest neighbors in joint space.
         standardize (bool, optional): Whether to standardize data before.
+        num_threads (int, optional): Number of threads for neighbour counting,
+            all cores if <= 0.
     Returns:
         Tuple of nearest neighbor arrays for X, Y, and Z.
     Raises:
         ValueError: Description
     """
 
-    # Import cython code
-    try:
-        import pyximport; pyximport.install()
-        import tigramite_cython_code
-    except ImportError:
-        raise ImportError("Could not import tigramite_cython_code, please"
-                          " compile cython code first as described in Readme.")
-
     dim, T = array.shape
 
     if standardize:
@@ -108,13 +105,11 @@ def _get_nearest_neighbors(array, xyz, k, standardize=True):
     tree_xyz = spatial.cKDTree(array.T)
     epsarray = tree_xyz.query(array.T, k=k+1, p=np.inf, eps=0.)[0][:,k].astype('float')
 
-    # Prepare for fast cython access
-
     dim_x = int(np.where(xyz == 0)[0][-1] + 1)
     dim_y = int(np.where(xyz == 1)[0][-1] + 1 - dim_x)
 
-    k_xz, k_yz, k_z = tigramite_cython_code._get_neighbors_within_eps_cython(array, T, dim_x, dim_y, epsarray,
-            k, dim)
+    # compiled kernel if built, k-d trees otherwise
+    k_xz, k_yz, k_z = get_neighbours_within_eps(array, dim_x, dim_y, epsarray, num_threads)
 
     return k_xz, k_yz, k_z
 
@@ -0,0 +1,198 @@
+"""
+Surrogate p-values and multiple testing procedures for large fields of hypotheses, e.g.
+all edges of a network. All functions work on flattened arrays in chunks, so inputs and outputs
+can be numpy memmaps and nothing of the size of the whole field is held in memory besides one
+sorted copy of p-values (FDR and Holm only).
+"""
+
+import numpy as np
+
+
+CHUNK_SIZE = 2**22
+
+
+
+def _chunks(n, chunk_size):
+    """
+    Yields slices covering range(n) by chunk_size.
+    """
+
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(start + chunk_size, n))
+
+
+
+def count_exceedances(field, surr, counts = None, chunk_size = CHUNK_SIZE):
+    """
+    Adds to counts (same shape as field, uint32) where field >= surr, i.e. updates number of
+    surrogates not exceeding the data. Use with one surrogate at a time, so surrogates can be
+    streamed and never stacked. If counts is None, new zero array is created.
+    Returns counts.
+    """
+
+    if field.shape != surr.shape:
+        raise Exception("Wrong input fields. surr has to have same shape as field!")
+    if counts is None:
+        counts = np.zeros(field.shape, dtype = np.uint32)
+
+    flat_field = np.reshape(field, (-1,))
+    flat_surr = np.reshape(surr, (-1,))
+    flat_counts = np.reshape(counts, (-1,))
+    for sl in _chunks(flat_field.shape[0], chunk_size):
+        flat_counts[sl] += np.greater_equal(flat_field[sl], flat_surr[sl])
+
+    return counts
+
+
+
+def get_p_vals_from_counts(counts, num_surr, one_tailed = True, out = None, chunk_size = CHUNK_SIZE):
+    """
+    Returns one-tailed or two-tailed p-values from counts of surrogates not exceeding the data
+    (see count_exceedances) out of num_surr surrogates.
+    If out is given (e.g. memmap), p-values are written into it.
+    """
+
+    if out is None:
+        out = np.zeros(counts.shape, dtype = np.float64)
+
+    flat_counts = np.reshape(counts, (-1,))
+    flat_out = np.reshape(out, (-1,))
+    for sl in _chunks(flat_counts.shape[0], chunk_size):
+        sig = 1. - flat_counts[sl] / float(num_surr)
+        if one_tailed:
+            flat_out[sl] = sig
+        else:
+            flat_out[sl] = 2 * np.minimum(sig, 1. - sig)
+
+    return out
+
+
+
+def _get_hypotheses(p_vals, Nhyp):
+    """
+    Returns flattened p-values of Nhyp hypotheses, chopping off the tail if
+    Nhyp < number of p-values, and the number of hypotheses.
+    """
+
+    flat_p_vals = np.reshape(p_vals, (-1,))
+    if Nhyp is None:
+        Nhyp = flat_p_vals.shape[0]
+
+    # if the number of hypotheses is higher than the Nhyp (can happen for robustness testing)
+    # remove the tail elements of p_vals until p_vals has the length Nhyp
+    if Nhyp < flat_p_vals.shape[0]:
+        flat_p_vals = flat_p_vals[:Nhyp]
+
+    return flat_p_vals, Nhyp
+
+
+
+def _threshold(p_vals, flat_p_vals, level, strict, out, chunk_size):
+    """
+    Returns boolean array of flat_p_vals < level (if strict) or <= level. Output has shape
+    of p_vals, when no hypotheses were chopped off, else it is flat.
+    """
+
+    shape = p_vals.shape if flat_p_vals.shape[0] == p_vals.size else flat_p_vals.shape
+    if out is None:
+        out = np.zeros(shape, dtype = np.bool_)
+    flat_out = np.reshape(out, (-1,))
+
+    for sl in _chunks(flat_p_vals.shape[0], chunk_size):
+        if strict:
+            flat_out[sl] = np.less(flat_p_vals[sl], level)
+        else:
+            flat_out[sl] = np.less_equal(flat_p_vals[sl], level)
+
+    return out
+
+
+
+def bonferroni_test(p_vals, sig_level, Nsurr, Nhyp = None, Sidak = False, out = None, chunk_size = CHUNK_SIZE):
+    """
+    Run a Bonferroni multiple testing procedure on p-values <p_vals> with significance
+    level <sig_level> given that <Nsurr> surrogates were used to compute the p-values.
+    Optionally the number of simultaneously tested hypotheses can be set with <Nhyp>,
+    if left at None, p_vals.size will be used.
+    If Sidak is True, will run Bonferroni-Sidak test.
+    If out is given (e.g. memmap), the result is written into it.
+    """
+
+    flat_p_vals, Nhyp = _get_hypotheses(p_vals, Nhyp)
+
+    if not Sidak:
+        bonf_level = sig_level / Nhyp
+    else:
+        bonf_level = 1.0 - (1.0 - sig_level) ** (1.0 / Nhyp)
+
+    if bonf_level < 1.0 / Nsurr:
+        raise Exception("Will not run Bonferroni, not enough surrogates available for the test!")
+
+    return _threshold(p_vals, flat_p_vals, bonf_level, True, out, chunk_size)
+
+
+
+def fdr_test(p_vals, sig_level, Nsurr, Nhyp = None, dependent = False, out = None, chunk_size = CHUNK_SIZE):
+    """
+    Run an FDR (Benjamini-Hochberg) multiple testing procedure on p-values <p_vals> with
+    significance level <sig_level> given that <Nsurr> surrogate were used to compute the p-values.
+    Optionally the number of simultaneously tested hypotheses can be set with <Nhyp>,
+    if left at None, p_vals.size will be used.
+    If dependent is True, runs Benjamini-Yekutieli procedure valid under arbitrary dependence.
+    If out is given (e.g. memmap), the result is written into it.
+    NOTE: if Nhyp < p_vals.size, the p_vals tail will be chopped off so that p_vals.size = Nhyp.
+          Then only will the test be run.
+    """
+
+    flat_p_vals, Nhyp = _get_hypotheses(p_vals, Nhyp)
+
+    bonf_level = sig_level / Nhyp
+
+    if bonf_level < 1.0 / Nsurr:
+        raise Exception("Will not run FDR, not enough surrogates used for the test!")
+
+    if dependent:
+        bonf_level /= np.sum(1. / np.arange(1, Nhyp + 1))
+
+    # the largest k with k-th smallest p-value <= k * level, all p-values up to the k-th are rejected
+    sorted_p_vals = np.sort(flat_p_vals)
+    level = -np.inf
+    for sl in _chunks(Nhyp, chunk_size):
+        passed = np.flatnonzero(sorted_p_vals[sl] <= np.arange(sl.start + 1, sl.stop + 1) * bonf_level)
+        if passed.shape[0] > 0:
+            level = sorted_p_vals[sl.start + passed[-1]]
+    del sorted_p_vals
+
+    return _threshold(p_vals, flat_p_vals, level, False, out, chunk_size)
+
+
+
+def holm_test(p_vals, sig_level, Nsurr, Nhyp = None, out = None, chunk_size = CHUNK_SIZE):
+    """
+    Run a Bonferroni-Holm multiple testing procedure on p-values <p_vals> with significance
+    level <sig_level> given that <Nsurr> surrogate were used to compute the p-values.
+    Optionally the number of simultaneously tested hypotheses can be set with <Nhyp>,
+    if left at None, p_vals.size will be used.
+    If out is given (e.g. memmap), the result is written into it.
+    NOTE: if Nhyp < p_vals.size, the p_vals tail will be chopped off so that p_vals.size = Nhyp.
+          Then only will the test be run.
+    """
+
+    flat_p_vals, Nhyp = _get_hypotheses(p_vals, Nhyp)
+
+    bonf_level = sig_level / Nhyp
+
+    if bonf_level < 1.0 / Nsurr:
+        raise Exception("Will not run Bonferroni-Holm test, not enough surrogates used for the test!")
+
+    # the first i-th smallest p-value > level / (Nhyp - i) stops the procedure, all smaller are rejected
+    sorted_p_vals = np.sort(flat_p_vals)
+    level = np.inf
+    for sl in _chunks(Nhyp, chunk_size):
+        failed = np.flatnonzero(sorted_p_vals[sl] > sig_level / (Nhyp - np.arange(sl.start, sl.stop, dtype = np.float64)))
+        if failed.shape[0] > 0:
+            level = sorted_p_vals[sl.start + failed[0]]
+            break
+    del sorted_p_vals
+
+    return _threshold(p_vals, flat_p_vals, level, True, out, chunk_size)
@@ -5,6 +5,7 @@ created on May 6, 2015
 """
 
 import numpy as np
+import gaussian_information as gauss
 
 
 def get_time_series_condition(ts, tau = 1, reversed = False, dim_of_condition = 1, eta = 0, close_condition = False, phase_diff = False):
@@ -71,6 +72,67 @@ def get_time_series_condition(ts, tau = 1, reversed = False, dim_of_condition =
 
 
 
+def lagged_cond_mutual_information(ts, taus, eta = 0, dim_of_condition = 1, algorithm = 'EQQ2', bins = 8, 
+                                   log2 = True, reversed = False, close_condition = False, phase_diff = False):
+    """
+    Returns conditional mutual information I(x; y | z) for all forward lags in taus with x, y and z
+    as from get_time_series_condition (see there for eta, dim_of_condition, reversed, close_condition
+    and phase_diff), using binning algorithm 'EQD', 'EQQ' or 'EQQ2' (see cond_mutual_information).
+    ts is a list of master and slave time series (or 2 x length array). Each of them can be
+    also 2D (num_surr x length), e.g. a batch of surrogates; then CMI is computed for every pair
+    and the result is num_surr x len(taus), otherwise len(taus).
+    Master and slave are binned only once over their whole length and the lagged variables
+    are views into the labels, so the bins may slightly differ from binning each lag separately
+    with cond_mutual_information. With phase_diff, y has to be binned for every lag.
+    """
+
+    log_f = np.log2 if log2 else np.log
+
+    if len(ts) != 2:
+        raise Exception("Input must be a list of master and slave time series (or a 2 x length array).")
+    master = np.atleast_2d(ts[1] if reversed else ts[0])
+    slave = np.atleast_2d(ts[0] if reversed else ts[1])
+    if master.shape[-1] != slave.shape[-1]:
+        raise Exception("Both time series must be the same length.")
+    if (dim_of_condition > 1 and eta == 0):
+        raise Exception("For multidimensional condition the backward lag eta must be chosen.")
+    num_batch = max(master.shape[0], slave.shape[0])
+    if master.shape[0] not in [1, num_batch] or slave.shape[0] not in [1, num_batch]:
+        raise Exception("Batches of master and slave time series must have the same size.")
+
+    num_tm = master.shape[-1]
+    n_eta = dim_of_condition - 1
+    # bin each series once
+    master_labels = get_bin_labels(master.T, algorithm, bins).T
+    slave_labels = get_bin_labels(slave.T, algorithm, bins).T
+
+    cmi = np.zeros((num_batch, len(taus)))
+    for b in range(num_batch):
+        m_lab = master_labels[b if master.shape[0] > 1 else 0]
+        s_lab = slave_labels[b if slave.shape[0] > 1 else 0]
+        for i, tau in enumerate(taus):
+            n = num_tm - tau - n_eta*eta
+            x = m_lab[n_eta*eta : n_eta*eta + n]
+            y = s_lab[n_eta*eta + tau : n_eta*eta + tau + n]
+            z = []
+            for d in range(dim_of_condition):
+                start = (n_eta - d)*eta + tau - 1 if close_condition else (n_eta - d)*eta
+                z.append(s_lab[start : start + n])
+            if phase_diff:
+                s_ts = slave[b if slave.shape[0] > 1 else 0]
+                start = n_eta*eta + tau - 1 if close_condition else n_eta*eta
+                y_diff = s_ts[n_eta*eta + tau : n_eta*eta + tau + n] - s_ts[start : start + n]
+                y_diff[y_diff < -np.pi] += 2*np.pi
+                y = get_bin_labels(y_diff, algorithm, bins)
+            cmi[b, i] = _get_cmi_from_labels([x], [y], z, bins, log_f)
+
+    if master.shape[0] == 1 and slave.shape[0] == 1 and np.ndim(ts[0]) == 1 and np.ndim(ts[1]) == 1:
+        return cmi[0]
+    else:
+        return cmi
+
+
+
 def mutual_information(x, y, algorithm = 'EQQ', bins = 8, log2 = True):
     """
     Computes mutual information between two time series x and y as
@@ -95,84 +157,111 @@ def mutual_information(x, y, algorithm = 'EQQ', bins = 8, log2 = True):
 
     log_f = np.log2 if log2 else np.log
 
+    x_labels = get_bin_labels(x, algorithm, bins)
+    y_labels = get_bin_labels(y, algorithm, bins)
+
+    return _get_cmi_from_labels([x_labels], [y_labels], [], bins, log_f)
+
+
+
+def get_bin_labels(ts, algorithm, bins, dtype = np.int64):
+    """
+    Returns bin labels 0 ... bins-1 (as dtype) of time series ts, as binned by histogram
+    in mutual information with binning algorithm 'EQD', 'EQQ' or 'EQQ2'.
+    ts is 1D time series or time x space array, then every column is binned on its own.
+    Edges are found on sorted time series, for EQQ2 the edge shifting on ties is resolved
+    at once from the first and last index of the run of samples equal to the edge.
+    """
+
+    ts = np.asarray(ts)
+    field = np.reshape(ts, (ts.shape[0], -1))
+    field_sorted = np.sort(field, axis = 0)
+    num_tm = field.shape[0]
+    cols = np.arange(field.shape[1])
+
     if algorithm == 'EQD':
-        x_bins = bins
-        y_bins = bins
-        xy_bins = bins
+        # equidistant edges between min and max, as in histogram
+        lo, hi = field_sorted[0, :], field_sorted[-1, :]
+        const = lo == hi
+        lo, hi = np.where(const, lo - 0.5, lo), np.where(const, hi + 0.5, hi)
+        inner_edges = np.linspace(lo, hi, bins + 1)[1:-1]
 
     elif algorithm == 'EQQ':
-        # create EQQ bins
-        x_sorted = np.sort(x)
-        x_bins = [x.min()]
-        [x_bins.append(x_sorted[i*x.shape[0]/bins]) for i in range(1, bins)]
-        x_bins.append(x.max())
-
-        y_sorted = np.sort(y)
-        y_bins = [y.min()]
-        [y_bins.append(y_sorted[i*y.shape[0]/bins]) for i in range(1, bins)]
-        y_bins.append(y.max())
-        
-        xy_bins = [x_bins, y_bins]
+        inner_edges = field_sorted[np.arange(1, bins) * num_tm // bins, :]
 
     elif algorithm == 'EQQ2':
-        x_sorted = np.sort(x)
-        x_bins = [x.min()]
-        one_bin_count = x.shape[0] / bins
+        inner_edges = np.zeros((bins - 1, field.shape[1]), dtype = field_sorted.dtype)
         for i in range(1, bins):
-            idx = i * one_bin_count
-            if np.all(np.diff(x_sorted[idx-1:idx+2]) != 0):
-                x_bins.append(x_sorted[idx])
-            elif np.any(np.diff(x_sorted[idx-1:idx+2]) == 0):
-                where = np.where(np.diff(x_sorted[idx-1:idx+2]) != 0)[0]
-                expand_idx = 1
-                while where.size == 0:
-                    where = np.where(np.diff(x_sorted[idx-expand_idx:idx+1+expand_idx]) != 0)[0]
-                    expand_idx += 1
-                if where[0] == 0:
-                    x_bins.append(x_sorted[idx-expand_idx])
-                else:
-                    x_bins.append(x_sorted[idx+expand_idx])
-        x_bins.append(x.max())
-
-        y_sorted = np.sort(y)
-        y_bins = [y.min()]
-        one_bin_count = y.shape[0] / bins
-        for i in range(1, bins):
-            idx = i * one_bin_count
-            if np.all(np.diff(y_sorted[idx-1:idx+2]) != 0):
-                y_bins.append(y_sorted[idx])
-            elif np.any(np.diff(y_sorted[idx-1:idx+2]) == 0):
-                where = np.where(np.diff(y_sorted[idx-1:idx+2]) != 0)[0]
-                expand_idx = 1
-                while where.size == 0:
-                    where = np.where(np.diff(y_sorted[idx-expand_idx:idx+1+expand_idx]) != 0)[0]
-                    expand_idx += 1
-                if where[0] == 0:
-                    y_bins.append(y_sorted[idx-expand_idx])
-                else:
-                    y_bins.append(y_sorted[idx+expand_idx])
-        y_bins.append(y.max())
-
-        xy_bins = [x_bins, y_bins]
-
-    # histo
-    count_x = np.histogramdd([x], bins = [x_bins])[0]
-    count_y = np.histogramdd([y], bins = [y_bins])[0]
-    count_xy = np.histogramdd([x, y], bins = xy_bins)[0]
-
-    # normalise
-    count_xy /= np.float(np.sum(count_xy))
-    count_x /= np.float(np.sum(count_x))
-    count_y /= np.float(np.sum(count_y))
-
-    # sum
-    mi = 0
-    for i in range(bins):
-        for j in range(bins):
-            if count_x[i] != 0 and count_y[j] != 0 and count_xy[i, j] != 0:
-                mi += count_xy[i, j] * log_f(count_xy[i, j] / (count_x[i] * count_y[j]))
-
-    return mi
+            idx = i * (num_tm // bins)
+            val = field_sorted[idx, :]
+            # first and last index of the run of samples with the same value as the edge
+            first = np.sum(field_sorted < val, axis = 0)
+            last = np.sum(field_sorted <= val, axis = 0) - 1
+            # if the edge value is tied, the edge is shifted outside the run of tied samples
+            edge_idx = np.where(first == idx, np.where(last == idx, idx, idx - 1), 
+                            np.where(last == idx, idx + 1, np.where(idx - first <= last - idx, first - 2, last + 2)))
+            inner_edges[i - 1] = field_sorted[np.minimum(edge_idx, num_tm - 1), cols]
+
+    else:
+        raise Exception("Unknown binning algorithm, please use 'EQD', 'EQQ' or 'EQQ2'.")
+
+    # label is the number of edges <= value, so the max falls to the last bin as in histogram
+    # (edges shifted by EQQ2 on heavy ties need not be monotone, counting does not mind)
+    labels = np.zeros(field.shape, dtype = dtype)
+    for edge in inner_edges:
+        labels += np.greater_equal(field, edge).astype(dtype)
+
+    return np.reshape(labels, ts.shape)
+
+
+
+def _encode_labels(labels, bins):
+    """
+    Encodes tuples of bin labels (list of arrays) to single integer per sample.
+    """
+
+    code = np.zeros(labels[0].shape, dtype = np.int64)
+    for label in labels:
+        code = code * bins + label
+
+    return code
+
+
+
+def _get_cmi_from_labels(x, y, z, bins, log_f):
+    """
+    Returns conditional mutual information I(x; y | z) from bin labels of (possibly multi-dimensional)
+    variables, given as lists of label arrays; for empty z returns mutual information I(x; y).
+    The joint distribution is counted once over occupied states only, marginals xz, yz and z
+    are summed from it.
+    """
+
+    labels = x + y + z
+    states, counts = np.unique(_encode_labels(labels, bins), return_counts = True)
+    num_pts = float(np.sum(counts))
+
+    # decode occupied joint states to labels of each dimension
+    state_labels = []
+    for _ in range(len(labels)):
+        state_labels.insert(0, states % bins)
+        states = states // bins
+
+    def marginal(dims):
+        # counts of marginal over dims, for every occupied joint state
+        if len(dims) == 0:
+            return num_pts
+        _, inverse = np.unique(_encode_labels([ state_labels[d] for d in dims ], bins), return_inverse = True)
+        return np.bincount(inverse, weights = counts)[inverse]
+
+    x_dims = list(range(len(x)))
+    y_dims = list(range(len(x), len(x) + len(y)))
+    z_dims = list(range(len(x) + len(y), len(labels)))
+
+    count_z = marginal(z_dims)
+    count_xz = marginal(x_dims + z_dims)
+    count_yz = marginal(y_dims + z_dims)
+
+    return np.sum(counts / num_pts * log_f(count_z * counts / (count_xz * count_yz)))
 
 
 
@@ -183,7 +272,7 @@ def knn_mutual_information(x, y, k, standardize = True, symm_algorithm = True, d
         where p(x), p(y) and p(x, y) are probability distributions.
     Performs k-nearest neighbours search using k-dimensional tree.
     Uses sklearn.neighbors for KDTree class.
-    
+
     standardize - whether transform data to zero mean and unit variance
     symm_algorithm
       True - use symmetric algorithm with one eps in both dimensions
@@ -191,84 +280,273 @@ def knn_mutual_information(x, y, k, standardize = True, symm_algorithm = True, d
     dualtree - whether to use dualtree formalism in k-d tree for the k-NN search
       could lead to better performance with large N
 
+    For many estimates sharing a variable, use KNNEstimator directly.
+
     According to Kraskov A., Stogbauer H. and Grassberger P., Phys. Rev. E, 69, 2004.
     """
 
-    from sklearn.neighbors import KDTree
-    from scipy.special import digamma
+    return KNNEstimator(standardize, dualtree).mutual_information(x, y, k, symm_algorithm)
+
+
+
+class KNNEstimator():
+    """
+    k-nearest neighbours estimator of mutual information and conditional mutual information,
+    which keeps k-d trees of the last max_trees marginal variables it has seen (x, y, z and x
+    with z, not the joint spaces). Estimates sharing a variable (x against many y, lags, surrogates
+    or the same data with different k) build its trees only once.
+    Variables are recognised by their values, time series are given as 1D arrays, multi-dimensional
+    variables (e.g. conditions) as list of 1D arrays or dimension x time array.
+    Uses sklearn.neighbors for KDTree class, all trees use the maximum (Chebyshev) norm.
+
+    standardize - whether transform data to zero mean and unit variance
+    dualtree - whether to use dualtree formalism in k-d tree for the k-NN search
+      could lead to better performance with large N
+    max_trees - number of cached k-d trees, the least recently used is dropped first
+    """
+
+    def __init__(self, standardize = True, dualtree = True, leaf_size = 15, max_trees = 8):
+        from collections import OrderedDict
+
+        self.standardize = standardize
+        self.dualtree = dualtree
+        self.leaf_size = leaf_size
+        self.max_trees = max_trees
+        self.trees = OrderedDict()
+
+
+
+    def clear(self):
+        """
+        Removes all cached k-d trees.
+        """
+
+        self.trees.clear()
+
+
+
+    def _prepare(self, ts):
+        """
+        Returns variable as time x dimension array, standardized if required.
+        Input is not modified.
+        """
+
+        ts = np.atleast_2d(np.array(ts, dtype = np.float64)).T
+        if self.standardize:
+            ts = ts - np.mean(ts, axis = 0)
+            ts /= np.std(ts, axis = 0, ddof = 1)
+
+        return np.ascontiguousarray(ts)
+
+
+
+    def _build_tree(self, data):
+        """
+        Returns new k-d tree of data (time x dimension).
+        """
+        from sklearn.neighbors import KDTree
+
+        return KDTree(data, leaf_size = self.leaf_size, metric = "chebyshev")
+
+
+
+    def _get_tree(self, data):
+        """
+        Returns k-d tree of data (time x dimension) from the cache, builds it only when not cached.
+        """
+        import hashlib
+
+        key = (data.shape, hashlib.sha1(data).hexdigest())
+        if key in self.trees:
+            tree = self.trees.pop(key)
+        else:
+            tree = self._build_tree(data)
+            if len(self.trees) >= self.max_trees:
+                self.trees.popitem(last = False)
+        if self.max_trees > 0:
+            self.trees[key] = tree
+
+        return tree
+
+
+
+    def _get_knn(self, data, k):
+        """
+        Returns distance of each point to its k-th nearest neighbour and index of that neighbour.
+        The joint space is different for every estimate, so its tree is not cached.
+        """
+
+        dist, ind = self._build_tree(data).query(data, k = k + 1, return_distance = True, dualtree = self.dualtree)
+
+        return dist[:, -1], ind[:, -1]
+
+
+
+    def _get_mi(self, x, x_tree, y, y_tree, k, symm_algorithm):
+        """
+        Computes mutual information between prepared x and y with trees of their marginal spaces.
+        """
+        from scipy.special import digamma
+
+        num_pts = x.shape[0]
+
+        dist, ind = self._get_knn(np.hstack([x, y]), k)
 
-    # prepare data
-    if standardize:
-        x = _center_ts(x)
-        y = _center_ts(y)
-    data = np.vstack([x, y]).T
-
-    # build k-d tree using the maximum (Chebyshev) norm
-    tree = KDTree(data, leaf_size = 15, metric = "chebyshev")
-    # find k-nearest neighbour indices for each point
-    dist, ind = tree.query(data, k = k + 1, return_distance = True, dualtree = dualtree)
-
-    sum_ = 0
-    for n in range(data.shape[0]):
-        # find x and y distances between nth point and its k-nearest neighbour
-        eps_x = np.abs(data[n, 0] - data[ind[n, -1], 0])
-        eps_y = np.abs(data[n, 1] - data[ind[n, -1], 1])
         if symm_algorithm:
             # use symmetric algorithm with one eps - see the paper
-            eps = np.max((eps_x, eps_y))
-            # find number of points within eps distance
-            n_x = np.sum(np.less(np.abs(x - x[n]), eps)) - 1
-            n_y = np.sum(np.less(np.abs(y - y[n]), eps)) - 1
-            # add to digamma sum
-            sum_ += digamma(n_x + 1) + digamma(n_y + 1)
+            n_x = _count_neighbours(x_tree, x, dist, strict = True) - 1
+            n_y = _count_neighbours(y_tree, y, dist, strict = True) - 1
+            sum_ = np.sum(digamma(n_x + 1) + digamma(n_y + 1)) / num_pts
+
+            return digamma(k) - sum_ + digamma(num_pts)
         else:
             # use asymmetric algorithm with eps_x and eps_y - see the paper
-            # find number of points within eps distance
-            n_x = np.sum(np.less(np.abs(x - x[n]), eps_x)) - 1
-            n_y = np.sum(np.less(np.abs(y - y[n]), eps_y)) - 1
-            # add to digamma sum
-            if n_x != 0:
-                sum_ += digamma(n_x) 
-            if n_y != 0:
-                sum_ += digamma(n_y)
-
-    sum_ /= data.shape[0]
-
-    if symm_algorithm:
-        return digamma(k) - sum_ + digamma(data.shape[0])
-    else:
-        return digamma(k) - 1./k - sum_ + digamma(data.shape[0])
+            n_x = _count_neighbours(x_tree, x, np.abs(x[:, 0] - x[ind, 0]), strict = True) - 1
+            n_y = _count_neighbours(y_tree, y, np.abs(y[:, 0] - y[ind, 0]), strict = True) - 1
+            sum_ = (np.sum(digamma(n_x[n_x != 0])) + np.sum(digamma(n_y[n_y != 0]))) / num_pts
+
+            return digamma(k) - 1./k - sum_ + digamma(num_pts)
+
+
+
+    def _get_cmi(self, x, y, z, xz_tree, z_tree, k, use_kernel, num_threads):
+        """
+        Computes conditional mutual information between prepared x and y conditioned on z
+        with trees of marginal spaces xz and z (not needed when use_kernel).
+        """
+
+        data = np.hstack([x, y, z])
+
+        dist, _ = self._get_knn(data, k)
+
+        # count points in marginal spaces xz, yz and z in a given dist from a point
+        if use_kernel:
+            # kernel counts distances < eps, the largest float above dist gives <= dist
+            n_x_z, n_y_z, n_z = get_neighbours_within_eps(data.T, x.shape[1], y.shape[1], np.nextafter(dist, np.inf), num_threads)
+            n_x_z, n_y_z, n_z = n_x_z - 2, n_y_z - 2, n_z - 2
+        else:
+            yz = np.hstack([y, z])
+            n_x_z = _count_neighbours(xz_tree, np.hstack([x, z]), dist) - 2
+            n_y_z = _count_neighbours(self._build_tree(yz), yz, dist) - 2
+            n_z = _count_neighbours(z_tree, z, dist) - 2
+
+        sum_ = np.sum(_neg_harmonic(n_x_z) + _neg_harmonic(n_y_z) - _neg_harmonic(n_z)) / x.shape[0]
+
+        return sum_ - _neg_harmonic(k-1)
 
 
 
-def _center_ts(ts):
+    def mutual_information(self, x, y, k, symm_algorithm = True):
+        """
+        Computes mutual information between x and y, see knn_mutual_information.
+        """
+
+        x = self._prepare(x)
+        y = self._prepare(y)
+
+        return self._get_mi(x, self._get_tree(x), y, self._get_tree(y), k, symm_algorithm)
+
+
+
+    def cond_mutual_information(self, x, y, z, k, use_kernel = False, num_threads = 0):
+        """
+        Computes conditional mutual information between x and y conditioned on z,
+        see knn_cond_mutual_information. If use_kernel, points in marginal spaces are counted
+        by get_neighbours_within_eps (compiled, in num_threads threads) instead of cached k-d trees.
+        """
+
+        x = self._prepare(x)
+        y = self._prepare(y)
+        z = self._prepare(z)
+
+        xz_tree, z_tree = None, None
+        if not use_kernel:
+            xz_tree, z_tree = self._get_tree(np.hstack([x, z])), self._get_tree(z)
+
+        return self._get_cmi(x, y, z, xz_tree, z_tree, k, use_kernel, num_threads)
+
+
+
+    def mutual_information_batch(self, x, ys, k, symm_algorithm = True):
+        """
+        Computes mutual information between x and each of ys (list of time series or
+        array with series in rows, e.g. lags or surrogates). Returns array of estimates.
+        x and its tree are prepared only once, trees of ys are not cached.
+        """
+
+        x = self._prepare(x)
+        x_tree = self._get_tree(x)
+
+        mis = []
+        for y in ys:
+            y = self._prepare(y)
+            mis.append(self._get_mi(x, x_tree, y, self._build_tree(y), k, symm_algorithm))
+
+        return np.array(mis)
+
+
+
+    def cond_mutual_information_batch(self, x, ys, z, k, use_kernel = False, num_threads = 0):
+        """
+        Computes conditional mutual information between x and each of ys (list of time series
+        or array with series in rows) conditioned on z. Returns array of estimates.
+        x, z and trees of xz and z are prepared only once.
+        """
+
+        x = self._prepare(x)
+        z = self._prepare(z)
+
+        xz_tree, z_tree = None, None
+        if not use_kernel:
+            xz_tree, z_tree = self._get_tree(np.hstack([x, z])), self._get_tree(z)
+
+        return np.array([ self._get_cmi(x, self._prepare(y), z, xz_tree, z_tree, k, use_kernel, num_threads) for y in ys ])
+
+
+
+def _count_neighbours(tree, data, radius, strict = False):
     """
-    Returns centered time series with zero mean and unit variance.
+    Returns number of points of data within radius (per point) from each point using its
+    k-d tree, the point itself included. If strict, only distances < radius are counted.
     """
 
-    if np.squeeze(ts).ndim != 1:
-        raise Exception("Only 1D time series can be centered")
-    ts -= np.mean(ts)
-    ts /= np.std(ts, ddof = 1)
+    if strict:
+        # d < r is d <= largest float below r, nothing is closer than 0
+        radius = np.where(radius > 0, np.nextafter(radius, 0), -1.)
 
-    return ts
+    return tree.query_radius(data, r = radius, count_only = True)
 
 
 
-def _get_corr_entropy(list_ts, log2 = True):
+def get_neighbours_within_eps(array, dim_x, dim_y, epsarray, num_threads = 0):
     """
-    Returns modified entropy to use in Gaussian correlation matrix CMI computation.
-        H = -0.5 * sum( log(eigvals) )
-    where eigvals are eigenvalues of correlation matrix between time series.
+    Returns numbers of points closer than epsarray (per point, maximum norm) to each point
+    in subspaces XZ, YZ and Z, the point itself included, as for Frenzel-Pompe CMI estimate.
+    array is dim x T, the first dim_x rows are X, next dim_y rows Y, the rest is Z.
+    For empty Z, all T points are counted in Z.
+    Uses compiled kernel from tigramite_cython_code (build with: cd src; python setup.py build_ext --inplace)
+    with num_threads threads (all cores if <= 0), when not built, k-d trees are used.
     """
 
-    log_f = np.log2 if log2 else np.log
+    array = np.ascontiguousarray(array, dtype = np.float64)
+    epsarray = np.ascontiguousarray(epsarray, dtype = np.float64)
+    dim, T = array.shape
+
+    try:
+        import tigramite_cython_code
+        return tigramite_cython_code._get_neighbors_within_eps_cython(array, T, dim_x, dim_y, epsarray, 0, dim, num_threads)
+    except ImportError:
+        from sklearn.neighbors import KDTree
 
-    corr_matrix = np.corrcoef(list_ts)
-    eigvals = np.linalg.eigvals(corr_matrix)
-    eigvals = eigvals[eigvals > 0.]
+    def count(rows):
+        if len(rows) == 0:
+            return np.full((T,), T, dtype = np.int64)
+        data = np.ascontiguousarray(array[rows, :].T)
+        return _count_neighbours(KDTree(data, leaf_size = 15, metric = "chebyshev"), data, epsarray, strict = True)
 
-    return -0.5 * np.nansum(log_f(eigvals))
+    z_rows = list(range(dim_x + dim_y, dim))
+
+    return count(list(range(dim_x)) + z_rows), count(list(range(dim_x, dim_x + dim_y)) + z_rows), count(z_rows)
 
 
 
@@ -306,179 +584,21 @@ def cond_mutual_information(x, y, z, algorithm = 'EQQ', bins = 8, log2 = True):
         y = np.atleast_2d(y)
         z = np.atleast_2d(z)
 
-        if algorithm == 'EQQ':
-            # create EQQ bins -- condition [possibly multidimensional]
-            z_bins = [] # arrays of bins for all conditions
-            for cond in range(z.shape[0]):
-                z_sorted = np.sort(z[cond, :])
-                z_bin = [z_sorted.min()]
-                [z_bin.append(z_sorted[i*z_sorted.shape[0]/bins]) for i in range(1, bins)]
-                z_bin.append(z_sorted.max())
-                z_bins.append(np.array(z_bin))
-
-            # create EQQ bins -- variables
-            x_bins = []
-            for cond in range(x.shape[0]):
-                x_sorted = np.sort(x[cond, :])
-                x_bin = [x_sorted.min()]
-                [x_bin.append(x_sorted[i*x_sorted.shape[0]/bins]) for i in range(1, bins)]
-                x_bin.append(x_sorted.max())
-                x_bins.append(np.array(x_bin))
-
-            y_bins = []
-            for cond in range(y.shape[0]):
-                y_sorted = np.sort(y[cond, :])
-                y_bin = [y_sorted.min()]
-                [y_bin.append(y_sorted[i*y_sorted.shape[0]/bins]) for i in range(1, bins)]
-                y_bin.append(y_sorted.max())
-                y_bins.append(np.array(y_bin))
-
-            # create multidim bins for histogram
-            xyz_bins = x_bins + y_bins + z_bins
-
-            xz_bins = x_bins + z_bins
-
-            yz_bins = y_bins + z_bins
-
-
-        elif algorithm == 'EQQ2':
-            # create EQQ bins -- condition [possibly multidimensional]
-            z_bins = [] # arrays of bins for all conditions
-            for cond in range(z.shape[0]):
-                z_sorted = np.sort(z[cond, :])
-                z_bin = [z_sorted.min()]
-                one_bin_count = z_sorted.shape[0] / bins
-                for i in range(1, bins):
-                    idx = i * one_bin_count
-                    if np.all(np.diff(z_sorted[idx-1:idx+2]) != 0):
-                        z_bin.append(z_sorted[idx])
-                    elif np.any(np.diff(z_sorted[idx-1:idx+2]) == 0):
-                        where = np.where(np.diff(z_sorted[idx-1:idx+2]) != 0)[0]
-                        expand_idx = 1
-                        while where.size == 0:
-                            where = np.where(np.diff(z_sorted[idx-expand_idx:idx+1+expand_idx]) != 0)[0]
-                            expand_idx += 1
-                        if where[0] == 0:
-                            z_bin.append(z_sorted[idx-expand_idx])
-                        else:
-                            z_bin.append(z_sorted[idx+expand_idx])
-                z_bin.append(z_sorted.max())
-                z_bin = np.array(z_bin)
-                z_bins.append(np.array(z_bin))
-
-            # create EQQ bins -- variables
-            x_bins = [] # arrays of bins for all conditions
-            for cond in range(x.shape[0]):
-                x_sorted = np.sort(x[cond, :])
-                x_bin = [x_sorted.min()]
-                one_bin_count = x_sorted.shape[0] / bins
-                for i in range(1, bins):
-                    idx = i * one_bin_count
-                    if np.all(np.diff(x_sorted[idx-1:idx+2]) != 0):
-                        x_bin.append(x_sorted[idx])
-                    elif np.any(np.diff(x_sorted[idx-1:idx+2]) == 0):
-                        where = np.where(np.diff(x_sorted[idx-1:idx+2]) != 0)[0]
-                        expand_idx = 1
-                        while where.size == 0:
-                            where = np.where(np.diff(x_sorted[idx-expand_idx:idx+1+expand_idx]) != 0)[0]
-                            expand_idx += 1
-                        if where[0] == 0:
-                            x_bin.append(x_sorted[idx-expand_idx])
-                        else:
-                            x_bin.append(x_sorted[idx+expand_idx])
-                x_bin.append(x_sorted.max())
-                x_bin = np.array(x_bin)
-                x_bins.append(np.array(x_bin))
-
-            y_bins = [] # arrays of bins for all conditions
-            for cond in range(y.shape[0]):
-                y_sorted = np.sort(y[cond, :])
-                y_bin = [y_sorted.min()]
-                one_bin_count = y_sorted.shape[0] / bins
-                for i in range(1, bins):
-                    idx = i * one_bin_count
-                    if np.all(np.diff(y_sorted[idx-1:idx+2]) != 0):
-                        y_bin.append(y_sorted[idx])
-                    elif np.any(np.diff(y_sorted[idx-1:idx+2]) == 0):
-                        where = np.where(np.diff(y_sorted[idx-1:idx+2]) != 0)[0]
-                        expand_idx = 1
-                        while where.size == 0:
-                            where = np.where(np.diff(y_sorted[idx-expand_idx:idx+1+expand_idx]) != 0)[0]
-                            expand_idx += 1
-                        if where[0] == 0:
-                            y_bin.append(y_sorted[idx-expand_idx])
-                        else:
-                            y_bin.append(y_sorted[idx+expand_idx])
-                y_bin.append(y_sorted.max())
-                y_bin = np.array(y_bin)
-                y_bins.append(np.array(y_bin))
-
-            # create multidim bins for histogram
-            xyz_bins = x_bins + y_bins + z_bins
-
-            xz_bins = x_bins + z_bins
-
-            yz_bins = y_bins + z_bins
+        # bin every variable once, count joint distribution once
+        x_labels = list(get_bin_labels(x.T, algorithm, bins).T)
+        y_labels = list(get_bin_labels(y.T, algorithm, bins).T)
+        z_labels = list(get_bin_labels(z.T, algorithm, bins).T)
 
-        
-        elif algorithm == 'EQD':
-            # bins are just integer
-            xyz_bins = bins
-            xz_bins = bins
-            yz_bins = bins
-            z_bins = bins
-
-        # histo
-        count_z = np.histogramdd(z.T, bins = z_bins)[0]
-
-        xyz = np.vstack((x, y, z))
-        count_xyz = np.histogramdd(xyz.T, bins = xyz_bins)[0]
-
-        xz = np.vstack((x, z))
-        count_xz = np.histogramdd(xz.T, bins = xz_bins)[0]
-
-        yz = np.vstack((y, z))
-        count_yz = np.histogramdd(yz.T, bins = yz_bins)[0]
-
-        # normalise
-        count_z /= np.float(np.sum(count_z))
-        count_xyz /= np.float(np.sum(count_xyz))
-        count_xz /= np.float(np.sum(count_xz))
-        count_yz /= np.float(np.sum(count_yz))
-
-        # sum
-        cmi = 0
-        iterator = np.nditer(count_xyz, flags = ['multi_index'])
-        while not iterator.finished:
-            idx = iterator.multi_index
-            xz_idx = tuple([ item for sublist in [idx[:len(x)], idx[-len(z):]] for item in sublist ]) # creates index for xz histo
-            yz_idx = idx[-len(z)-len(y):]
-            z_idx = idx[-len(z):]
-            if count_xyz[idx] == 0 or count_z[z_idx] == 0 or count_xz[xz_idx] == 0 or count_yz[yz_idx] == 0:
-                iterator.iternext()
-                continue
-            else:
-                cmi += count_xyz[idx] * log_f(count_z[z_idx] * count_xyz[idx] / (count_xz[xz_idx] * count_yz[yz_idx]))
-
-            iterator.iternext()
+        cmi = _get_cmi_from_labels(x_labels, y_labels, z_labels, bins, log_f)
 
     elif algorithm == 'GCM':
         if len(z) <= 1:
             raise Exception("Gaussian correlation matrix method should be used with multidimensional condition.")
         
-        # center time series - zero mean, unit variance
-        x = _center_ts(x)
-        y = _center_ts(y)
-        for cond_ts in z:
-            cond_ts = _center_ts(cond_ts)
-
-        # get CMI
-        Hall = _get_corr_entropy([x, y] + list(z), log2 = log2)
-        Hxz = _get_corr_entropy([x] + list(z), log2 = log2)
-        Hyz = _get_corr_entropy([y] + list(z), log2 = log2)
-        Hz = _get_corr_entropy(z, log2 = log2)
-
-        cmi = Hall - Hxz - Hyz + Hz
+        # log-determinants of covariance sub-blocks, the condition takes rows 2 onwards
+        z = np.atleast_2d(z)
+        cov = gauss.get_covariance(np.vstack([x, y, z]))
+        cmi = gauss.cond_mutual_information(cov, 0, 1, [list(range(2, 2 + z.shape[0]))], log2 = log2)[0]
 
     return cmi
 
@@ -486,15 +606,17 @@ def cond_mutual_information(x, y, z, algorithm = 'EQQ', bins = 8, log2 = True):
 
 def _neg_harmonic(n):
     """
-    Returns a negative Nth harmonic number.
+    Returns a negative Nth harmonic number, n can be an array.
     For knn CMI computation
+        H(n) = digamma(n + 1) + euler_gamma
     """
+    from scipy.special import digamma
 
-    return -np.sum(1./np.arange(1,n+1))
+    return -(digamma(np.asarray(n) + 1.) + np.euler_gamma)
 
 
 
-def knn_cond_mutual_information(x, y, z, k, standardize = True, dualtree = True):
+def knn_cond_mutual_information(x, y, z, k, standardize = True, dualtree = True, use_kernel = False):
     """
     Computes conditional mutual information between two time series x and y 
     conditioned on a third z (which can be multi-dimensional) as
@@ -508,45 +630,11 @@ def knn_cond_mutual_information(x, y, z, k, standardize = True, dualtree = True)
       could lead to better performance with large N
 
     According to Frenzel S. and Pompe B., Phys. Rev. Lett., 99, 2007.
+
+    use_kernel - whether to count points in marginal spaces with get_neighbours_within_eps,
+      compiled kernel, better for long time series
+
+    For many estimates sharing a variable, use KNNEstimator directly.
     """
 
-    from sklearn.neighbors import KDTree
-
-    # prepare data
-    if standardize:
-        x = _center_ts(x)
-        y = _center_ts(y)
-        if isinstance(z, np.ndarray):
-            z = _center_ts(z)
-        elif isinstance(z, list):
-            for cond_ts in z:
-                cond_ts = _center_ts(cond_ts)
-    z = np.atleast_2d(z)
-    data = np.vstack([x, y, z]).T
-
-    # build k-d tree using the maximum (Chebyshev) norm
-    tree = KDTree(data, leaf_size = 15, metric = "chebyshev")
-    # find distance to k-nearest neighbour per point
-    dist, _ = tree.query(data, k = k + 1, return_distance = True, dualtree = dualtree)
-
-    sum_ = 0
-    # prepare marginal vectors xz, yz and z
-    n_x_z_data = np.delete(data, 1, axis = 1)
-    n_y_z_data = np.delete(data, 0, axis = 1)
-    n_z_data = np.delete(data, [0, 1], axis = 1)
-
-    # build and query k-d trees in marginal spaces for number of points in a given dist from a point
-    tree_x_z = KDTree(n_x_z_data, leaf_size = 15, metric = "chebyshev")
-    n_x_z = tree_x_z.query_radius(n_x_z_data, r = dist[:, -1], count_only = True) - 2
-    tree_y_z = KDTree(n_y_z_data, leaf_size = 15, metric = "chebyshev")
-    n_y_z = tree_y_z.query_radius(n_y_z_data, r = dist[:, -1], count_only = True) - 2
-    tree_z = KDTree(n_z_data, leaf_size = 15, metric = "chebyshev")
-    n_z = tree_z.query_radius(n_z_data, r = dist[:, -1], count_only = True) - 2
-
-    # count points
-    for n in range(data.shape[0]):
-        sum_ += _neg_harmonic(n_x_z[n]) + _neg_harmonic(n_y_z[n]) - _neg_harmonic(n_z[n])
-
-    sum_ /= data.shape[0]
-
-    return sum_ - _neg_harmonic(k-1)
\ No newline at end of file
+    return KNNEstimator(standardize, dualtree).cond_mutual_information(x, y, z, k, use_kernel)
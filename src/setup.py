@@ -0,0 +1,58 @@
+"""
+Builds compiled extensions of src in place, so they are not compiled at import time:
+    cd src; python setup.py build_ext --inplace
+OpenMP is used when the compiler supports it (checked by building a small test program),
+set NO_OPENMP=1 to build without it anyway.
+"""
+
+import os
+from distutils.core import setup
+from distutils.extension import Extension
+from Cython.Build import cythonize
+import numpy as np
+
+
+def _get_openmp_flags():
+    """
+    Returns OpenMP flags if the compiler builds and links a small OpenMP program with them,
+    otherwise (e.g. clang on macOS) empty list, so the extension is built without OpenMP.
+    """
+    import shutil
+    import tempfile
+    from distutils.ccompiler import new_compiler
+    from distutils.errors import CompileError, LinkError
+    from distutils.sysconfig import customize_compiler
+
+    if os.environ.get("NO_OPENMP"):
+        return []
+
+    flags = ["-fopenmp"]
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp_dir, "test_openmp.c")
+        with open(src, "w") as f:
+            f.write("#include <omp.h>\nint main(void) { return omp_get_max_threads() > 0 ? 0 : 1; }\n")
+        objects = compiler.compile([src], output_dir = tmp_dir, extra_postargs = flags)
+        compiler.link_executable(objects, os.path.join(tmp_dir, "test_openmp"), extra_postargs = flags)
+    except (CompileError, LinkError):
+        print("OpenMP is not supported by the compiler, building without it.")
+        flags = []
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return flags
+
+
+
+openmp_flags = _get_openmp_flags()
+
+extensions = [
+    Extension("tigramite_cython_code", ["tigramite_cython_code.pyx"],
+              include_dirs = [np.get_include()],
+              extra_compile_args = ["-O3"] + openmp_flags,
+              extra_link_args = openmp_flags),
+]
+
+setup(name = "multi-scale-ext", ext_modules = cythonize(extensions))
@@ -5,14 +5,17 @@ created on Mar 4, 2014
 """
 
 import numpy as np
+import os
 from data_class import DataField
+import multiple_testing
 
 
 
 def get_p_vals(field, surr_field, one_tailed = True):
     """
     Returns one-tailed or two-tailed values of percentiles with respect to 
-    surrogate testing.
+    surrogate testing. surr_field is iterated over surrogates, so it can be a memmap
+    (see multiple_testing for streaming surrogates without stacking them).
     """
 
     num_surrs = surr_field.shape[0]
@@ -20,11 +23,11 @@ def get_p_vals(field, surr_field, one_tailed = True):
         raise Exception("Wrong input fields. surr_field has to have shape as num_surr x field.shape!")
 
     # get significance - p-values
-    sig = 1. - np.sum(np.greater_equal(field, surr_field), axis = 0) / float(num_surrs)
-    if one_tailed:
-        return sig
-    else:
-        return 2 * np.minimum(sig, 1. - sig)
+    counts = None
+    for surr in surr_field:
+        counts = multiple_testing.count_exceedances(field, surr, counts)
+
+    return multiple_testing.get_p_vals_from_counts(counts, num_surrs, one_tailed)
 
 
 
@@ -35,27 +38,12 @@ def bonferroni_test(p_vals, sig_level, Nsurr, Nhyp = None, Sidak = False):
     Optionally the number of simultaneously tested hypotheses can be set with <Nhyp>,
     if left at None, len(p_vals) will be used.
     If Sidak is True, will run Bonferroni-Sidak test.
+    See multiple_testing.bonferroni_test.
 
     Written by Martin Vejmelka -- https://github.com/vejmelkam/ndw-climate/blob/master/src/multi_stats.py
     """
 
-    if Nhyp is None:
-        Nhyp = len(p_vals)
-
-    # if the number of hypotheses is higher than the Nhyp (can happen for robustness testing)
-    # remove the tail elements of p_vals until p_vals has the length Nhyp
-    if Nhyp < len(p_vals):
-        p_vals = p_vals[:Nhyp]
-
-    if not Sidak:
-        bonf_level = sig_level / Nhyp
-    else:
-        bonf_level = 1.0 - (1.0 - sig_level) ** (1.0 / Nhyp)
-    
-    if bonf_level < 1.0 / Nsurr:
-        raise Exception("Will not run Bonferroni, not enough surrogates available for the test!")
-    
-    return p_vals < bonf_level
+    return multiple_testing.bonferroni_test(p_vals, sig_level, Nsurr, Nhyp, Sidak)
 
 
 
@@ -67,41 +55,12 @@ def fdr_test(p_vals, sig_level, Nsurr, Nhyp = None):
     if left at None, len(p_vals) will be used.
     NOTE: if Nhyp < len(p_vals), the p_vals tail will be chopped off so that len(p_val) = Nhyp.
           Then only will the test be run.
+    See multiple_testing.fdr_test.
 
     Written by Martin Vejmelka -- https://github.com/vejmelkam/ndw-climate/blob/master/src/multi_stats.py
     """
-    
-    if Nhyp is None:
-        Nhyp = len(p_vals)
 
-    # if the number of hypotheses is higher than the Nhyp (can happen for robustness testing)
-    # remove the tail elements of p_vals until p_vals has the length Nhyp
-    if Nhyp < len(p_vals):
-        p_vals = p_vals[:Nhyp]
-
-    # the sorting is done only after the number of p_vals is fixed, see comments.
-    sndx = np.argsort(p_vals)
-    
-    bonf_level = sig_level / Nhyp
-    
-    if bonf_level < 1.0 / Nsurr:
-        raise Exception("Will not run FDR, not enough surrogates used for the test!")
-    
-    Npvals = len(p_vals)
-    h = np.zeros((Npvals,), dtype = np.bool)
-    
-    # test the p-values in order of p-values (smallest first)
-    for i in range(Npvals - 1, 0, -1):
-        
-        # select the hypothesis with the i-th lowest p-value
-        hndx = sndx[i]
-        
-        # check if we satisfy the FDR condition
-        if p_vals[hndx] <= (i+1)*bonf_level:
-            h[sndx[:i+1]] = True
-            break
-        
-    return h
+    return multiple_testing.fdr_test(p_vals, sig_level, Nsurr, Nhyp)
 
 
 
@@ -113,41 +72,11 @@ def holm_test(p_vals, sig_level, Nsurr, Nhyp = None):
     if left at None, len(p_vals) will be used.
     NOTE: if Nhyp < len(p_vals), the p_vals tail will be chopped off so that len(p_val) = Nhyp.
           Then only will the test be run.
+    See multiple_testing.holm_test.
     Written by Martin Vejmelka -- https://github.com/vejmelkam/ndw-climate/blob/master/src/multi_stats.py 
     """
-    
-    if Nhyp is None:
-        Nhyp = len(p_vals)
 
-    # if the number of hypotheses is higher than the Nhyp (can happen for robustness testing)
-    # remove the tail elements of p_vals until p_vals has the length Nhyp
-    if Nhyp < len(p_vals):
-        p_vals = p_vals[:Nhyp]
-
-    # the sorting is done only after the number of p_vals is fixed, see comments.
-    sndx = np.argsort(p_vals)
-    
-    bonf_level = sig_level / Nhyp
-    
-    if bonf_level < 1.0 / Nsurr:
-        raise Exception("Will not run Bonferroni-Holm test, not enough surrogates used for the test!")
-
-    h = np.zeros((Nhyp,), dtype = np.bool)
-
-    # test the p-values in order of p-values (smallest first)
-    for i in range(Nhyp):
-        
-        # select the hypothesis with the i-th lowest p-value
-        hndx = sndx[i]
-        
-        # check if we have violated the Bonf-Holm condition
-        if p_vals[hndx] > sig_level / (Nhyp - i):
-            break
-        
-        # the hypothesis is true
-        h[hndx] = True
-            
-    return h
+    return multiple_testing.holm_test(p_vals, sig_level, Nsurr, Nhyp)
 
 
 
@@ -157,18 +86,13 @@ def get_single_FT_surrogate(ts, seed = None):
     Seed / integer : when None, random seed, else fixed seed (e.g. for multivariate FT surrogates).
     """
 
-    if seed is None:
-        np.random.seed()
-    else:
-        np.random.seed(seed)
-    xf = np.fft.rfft(ts, axis = 0)
-    angle = np.random.uniform(0, 2 * np.pi, (xf.shape[0],))
+    rng = np.random.RandomState(seed)
+    plan = SurrogatePlan(ts)
+    angle = rng.uniform(0, 2 * np.pi, (plan.num_freq, 1))
     # set the slowest frequency to zero, i.e. not to be randomised
     angle[0] = 0
 
-    cxf = xf * np.exp(1j * angle)
-
-    return np.fft.irfft(cxf, n = ts.shape[0], axis = 0)
+    return _compute_FT_surrogates_batch(plan, angle)[:, 0]
 
 
 
@@ -178,16 +102,11 @@ def get_single_AAFT_surrogate(ts, seed = None):
     Seed / integer : when None, random seed, else fixed seed (e.g. for multivariate AAFT surrogates).
     """
 
-    if seed is None:
-        np.random.seed()
-    else:
-        np.random.seed(seed)
-
-    xf = np.fft.rfft(ts, axis = 0)
-    angle = np.random.uniform(0, 2 * np.pi, (xf.shape[0],))
-    del xf
+    rng = np.random.RandomState(seed)
+    plan = SurrogatePlan(ts)
+    angle = rng.uniform(0, 2 * np.pi, (plan.num_freq, 1))
 
-    return _compute_AAFT_surrogates([None, ts, angle])[-1]
+    return _compute_AAFT_surrogates_batch(plan, angle, rng.randn(plan.num_tm, 1))[:, 0]
 
 
 
@@ -198,16 +117,11 @@ def get_single_IAAFT_surrogate(ts, n_iterations = 10, seed = None):
     Seed / integer : when None, random seed, else fixed seed (e.g. for multivariate IAAFT surrogates).
     """
 
-    if seed is None:
-        np.random.seed()
-    else:
-        np.random.seed(seed)
+    rng = np.random.RandomState(seed)
+    plan = SurrogatePlan(ts)
+    angle = rng.uniform(0, 2 * np.pi, (plan.num_freq, 1))
 
-    xf = np.fft.rfft(ts, axis = 0)
-    angle = np.random.uniform(0, 2 * np.pi, (xf.shape[0],))
-    del xf
-
-    return _compute_IAAFT_surrogates([ None, n_iterations, ts, angle])[-1]
+    return _compute_IAAFT_surrogates_batch(plan, angle, n_iterations, gaussian = rng.randn(plan.num_tm, 1))[0][:, 0]
 
 
 
@@ -217,7 +131,7 @@ def get_single_MF_surrogate(ts, randomise_from_scale = 2, seed = None):
     Seed / integer : when None, random seed, else fixed seed (e.g. for multivariate MF surrogates).
     """
 
-    return _compute_MF_surrogates([None, ts, randomise_from_scale, seed])[-1]
+    return _compute_MF_surrogates_batch(ts[:, np.newaxis], randomise_from_scale, _get_seed_stream(seed, 1))[0, :, 0]
 
 
 
@@ -233,9 +147,10 @@ def get_single_AR_surrogate(ts, order_range = [1,1], seed = None):
 
     _, order, res = _prepare_AR_surrogates([None, order_range, 'sbc', ts])
     num_ts = ts.shape[0] - order.order()
-    res = res[:num_ts, 0]
+    res = res[:num_ts, :]
 
-    surr = _compute_AR_surrogates([None, res, order, num_ts, seed])[-1]
+    rng = np.random.RandomState(seed)
+    surr = _compute_AR_surrogates_batch(order.A.T, order.w, _permute_columns(res, rng))[:, 0]
 
     if np.diff(order_range) == 0:
         return surr
@@ -267,164 +182,338 @@ def _prepare_AR_surrogates(a):
     
     
     
-def _compute_AR_surrogates(a):
-    i, res, model, num_tm_s, seed = a
-    r = np.zeros((num_tm_s, 1), dtype = np.float64)       
-    if not np.all(np.isnan(res)):
-        ndx = np.argsort(np.random.uniform(size = (num_tm_s,)))
-        r[ndx, 0] = res
-
-        ar_surr = model.simulate_with_residuals(r, seed)[:, 0]
-    else:
-        ar_surr = np.nan
-        
-    return (i, ar_surr)
-    
-    
-    
-def _compute_FT_surrogates(a):
-    i, data, angle = a
-            
-    # transform the time series to Fourier domain
-    xf = np.fft.rfft(data, axis = 0)
-     
-    # randomise the time series with random phases     
-    cxf = xf * np.exp(1j * angle)
-    
-    # return randomised time series in time domain
-    ft_surr = np.fft.irfft(cxf, n = data.shape[0], axis = 0)
+def _init_AR_worker(raw, shape):
+    """
+    Initializes worker process with data (time x space) in shared memory.
+    """
+
+    global _AR_shared_data
+    _AR_shared_data = np.reshape(np.frombuffer(raw, dtype = np.float64), shape)
+
+
+
+def _prepare_AR_surrogates_shared(a):
+    i, order_range, crit = a
+    return _prepare_AR_surrogates([i, order_range, crit, _AR_shared_data[:, i]])
+
+
+
+def _get_AR_cache_fname(cache_dir, data, order_range, crit):
+    """
+    Returns filename of cached AR models keyed by hash of the data, order range and criterion.
+    """
+    import hashlib
+
+    key = hashlib.sha1(np.ascontiguousarray(data).view(np.uint8))
+    key.update(repr((data.shape, data.dtype.str, list(order_range), crit)).encode())
+
+    return os.path.join(cache_dir, "AR_models_%s.bin" % key.hexdigest())
+
+
+
+def _compute_AR_surrogates_batch(coeffs, intercepts, residuals):
+    """
+    Simulates univariate AR(p) processes of all series at once with given residuals.
+    coeffs are AR coefficients as order x series (zero padded for lower orders), intercepts 
+    as series and residuals as time x series. The recursion starts from zero state, as 
+    the simulation with residuals in VARModel. Returns simulated series as time x series.
+    """
+
+    order = coeffs.shape[0]
+    u = np.zeros_like(coeffs)
+    ar_surr = np.zeros_like(residuals)
+
+    for t in range(residuals.shape[0]):
+        ar_surr[t, :] = intercepts + residuals[t, :] + np.sum(coeffs * u, axis = 0)
+        # shift the predictors back in time and store the prediction
+        if order > 1:
+            u[1:, :] = u[:-1, :]
+        if order > 0:
+            u[0, :] = ar_surr[t, :]
+
+    return ar_surr
+
+
+
+class SurrogatePlan():
+    """
+    Holds quantities of the original data (time x space, or 1D time series) which are the same
+    for every Fourier type surrogate realisation -- the spectrum and its amplitudes, sorted values
+    and ranks of the original data. Everything is computed on first use only, so the plan 
+    costs nothing which the selected algorithm does not need.
+    The data are held in dtype, so with np.float32 the whole pipeline runs in single precision
+    (complex64 spectra).
+    """
+
+    def __init__(self, data, dtype = np.float64):
+        self.original = data
+        self.dtype = np.dtype(dtype)
+        self.data = np.reshape(data, (data.shape[0], -1)).astype(self.dtype, copy = False)
+        self.num_tm = self.data.shape[0]
+        self.num_freq = self.num_tm // 2 + 1
+        self.spectrum = None
+        self.amplitudes = None
+        self.sorted_original = None
+        self.ranks = None
+
+
+
+    def get_spectrum(self):
+        if self.spectrum is None:
+            self.spectrum = np.fft.rfft(self.data, axis = 0)
+        return self.spectrum
+
+
+
+    def get_amplitudes(self):
+        if self.amplitudes is None:
+            self.amplitudes = np.abs(self.get_spectrum())
+        return self.amplitudes
+
+
+
+    def get_sorted_original(self):
+        if self.sorted_original is None:
+            self.sorted_original = np.sort(self.data, axis = 0)
+        return self.sorted_original
+
+
+
+    def get_ranks(self):
+        if self.ranks is None:
+            self.ranks = self.data.argsort(axis = 0).argsort(axis = 0)
+        return self.ranks
+
+
+
+def _compute_FT_surrogates_batch(plan, angle):
+    """
+    Computes FT surrogates of all time series in the plan (time x space) at once.
+    angle are random phases as (..., freq x space), with leading dimension for more 
+    realisations at once. Returns surrogates as (..., time x space).
+    """
+
+    # randomise cached spectrum by broadcasting and one inverse FFT
+    cxf = plan.get_spectrum() * np.exp(1j * angle)
+
+    return np.fft.irfft(cxf, n = plan.num_tm, axis = -2)
+
+
+
+def _rank_remap(sorted_values, ts):
+    """
+    Rearranges sorted_values (time x space) according to ranks of ts (..., time x space),
+    along the time axis.
+    """
+
+    ranks = ts.argsort(axis = -2).argsort(axis = -2)
     
-    return (i, ft_surr)
+    return np.take_along_axis(np.broadcast_to(sorted_values, ts.shape), ranks, axis = -2)
 
 
 
-def _compute_AAFT_surrogates(a):
-    i, data, angle = a
+def _compute_AAFT_surrogates_batch(plan, angle, gaussian = None):
+    """
+    Computes AAFT surrogates of all time series in the plan (time x space) at once.
+    angle are random phases as (..., freq x space). gaussian is white noise as (..., time x space),
+    if None, it is drawn from the global random generator. Returns surrogates as (..., time x space).
+    """
+
+    shape = angle.shape[:-2] + plan.data.shape
 
     # create Gaussian data
-    gaussian = np.random.randn(data.shape[0])
-    gaussian.sort(axis = 0)
+    if gaussian is None:
+        gaussian = np.random.randn(*shape)
+    gaussian = np.sort(gaussian.astype(plan.dtype, copy = False), axis = -2)
 
     # rescale data
-    ranks = data.argsort(axis = 0).argsort(axis = 0)
-    rescaled_data = gaussian[ranks]
+    rescaled_data = np.take_along_axis(gaussian, np.broadcast_to(plan.get_ranks(), shape), axis = -2)
 
-    # transform the time series to Fourier domain
-    xf = np.fft.rfft(rescaled_data, axis = 0)
-     
-    # randomise the time series with random phases     
+    # randomise the rescaled data with random phases
+    xf = np.fft.rfft(rescaled_data, axis = -2)
     cxf = xf * np.exp(1j * angle)
-    
-    # return randomised time series in time domain
-    ft_surr = np.fft.irfft(cxf, n = data.shape[0], axis = 0)
+    ft_surr = np.fft.irfft(cxf, n = plan.num_tm, axis = -2)
 
     # rescale back to amplitude distribution of original data
-    sorted_original = data.copy()
-    sorted_original.sort(axis = 0)
-    ranks = ft_surr.argsort(axis = 0).argsort(axis = 0)
+    return _rank_remap(plan.get_sorted_original(), ft_surr)
 
-    rescaled_data = sorted_original[ranks]
-    
-    return (i, rescaled_data)
 
 
+def _compute_IAAFT_surrogates_batch(plan, angle, n_iters, tol = None, gaussian = None):
+    """
+    Computes IAAFT surrogates of all time series in the plan (time x space) at once.
+    angle are random phases as (..., freq x space), gaussian is white noise for the AAFT starting
+    point as in _compute_AAFT_surrogates_batch. Each series (and realisation) is iterated
+    until its rank ordering stops changing (then the surrogate is a fixed point of the iteration),
+    or its relative spectral error falls below tol (if not None), or n_iters is reached.
+    Returns surrogates as (..., time x space), number of iterations and final relative 
+    spectral error as (..., space).
+    """
+
+    data = plan.data
+    num_tm = data.shape[0]
+    lead_shape = angle.shape[:-2]
+    num_real = int(np.prod(lead_shape))
 
-def _compute_IAAFT_surrogates(a):
-    i, n_iters, data, angle = a
+    # starting point, as time x (realisations * space) matrix
+    R = _compute_AAFT_surrogates_batch(plan, angle, gaussian)
+    R = np.reshape(R, (num_real, num_tm, data.shape[1])).transpose((1, 0, 2)).reshape((num_tm, -1))
 
-    xf = np.fft.rfft(data, axis = 0)
-    xf_amps = np.abs(xf)
-    sorted_original = data.copy()
-    sorted_original.sort(axis = 0)
+    xf_amps = np.tile(plan.get_amplitudes(), (1, num_real))
+    sorted_original = np.tile(plan.get_sorted_original(), (1, num_real))
 
-    # starting point
-    R = _compute_AAFT_surrogates([None, data, angle])[-1]
+    # sort buffers -- ordering from the previous iteration and the new one
+    perm_prev = R.argsort(axis = 0)
+    R_active = np.empty_like(R)
+    n_done = np.zeros((R.shape[1],), dtype = np.int64)
+    active = np.arange(R.shape[1])
 
     # iterate
     for _ in range(n_iters):
-        r_fft = np.fft.rfft(R, axis = 0)
+        r_fft = np.fft.rfft(R[:, active], axis = 0)
+
+        if tol is not None:
+            spec_err = np.linalg.norm(np.abs(r_fft) - xf_amps[:, active], axis = 0) / np.linalg.norm(xf_amps[:, active], axis = 0)
+            not_converged = spec_err >= tol
+            active = active[not_converged]
+            r_fft = r_fft[:, not_converged]
+        if active.shape[0] == 0:
+            break
+
         r_phases = r_fft / np.abs(r_fft)
 
-        s = np.fft.irfft(xf_amps * r_phases, n = data.shape[0], axis = 0)
+        s = np.fft.irfft(xf_amps[:, active] * r_phases, n = num_tm, axis = 0)
 
-        ranks = s.argsort(axis = 0).argsort(axis = 0)
-        R = sorted_original[ranks]
+        # the ordering of s is the inverse of the ranks, so sorted values are put directly in place
+        perm = s.argsort(axis = 0)
+        R_act = R_active[:, :active.shape[0]]
+        np.put_along_axis(R_act, perm, sorted_original[:, active], axis = 0)
+        R[:, active] = R_act
+        n_done[active] += 1
 
-    return (i, R)
+        # series with unchanged ranks have converged
+        changed = np.any(perm != perm_prev[:, active], axis = 0)
+        perm_prev[:, active] = perm
+        active = active[changed]
 
+    spec_err = np.linalg.norm(np.abs(np.fft.rfft(R, axis = 0)) - xf_amps, axis = 0) / np.linalg.norm(xf_amps, axis = 0)
 
-    
-def _compute_MF_surrogates(a):
-    import pywt
-    
-    i, ts, randomise_from_scale, seed = a
+    R = np.reshape(R, (num_tm, num_real, data.shape[1])).transpose((1, 0, 2)).reshape(lead_shape + data.shape)
+    info_shape = lead_shape + (data.shape[1],)
+
+    return R, np.reshape(n_done, info_shape), np.reshape(spec_err, info_shape)
+
+
+
+def _get_fresh_seed():
+    """
+    Returns random 64bit integer seed from OS entropy, independent of the global 
+    random state (so forked workers do not share it).
+    """
+    import binascii
+
+    return int(binascii.hexlify(os.urandom(8)), 16)
+
+
+
+def _get_seed_stream(seed, num, start = 0):
+    """
+    Returns num independent random number generators for realisations start, ..., start + num - 1,
+    derived deterministically from seed. The i-th realisation always gets the same generator, 
+    regardless of how the realisations are split into batches or processes.
+    If seed is None, fresh entropy is used.
+    Generators are spawned by SeedSequence when available (numpy >= 1.17), otherwise
+    seeded by [seed, realisation index].
+    """
 
     if seed is None:
-        np.random.seed()
+        seed = _get_fresh_seed()
+
+    if hasattr(np.random, 'SeedSequence'):
+        return [ np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed, spawn_key = (start + i,)))) 
+                    for i in range(num) ]
     else:
-        np.random.seed(seed)
-    
-    if not np.all(np.isnan(ts)):
-        n = int(np.log2(ts.shape[0])) # time series length should be 2^n
-        n_real = np.log2(ts.shape[0])
-        
-        if n != n_real:
-            # if time series length is not 2^n
-            raise Exception("Time series length must be power of 2 (2^n).")
-        
-        # get coefficient from discrete wavelet transform, 
-        # it is a list of length n with numpy arrays as every object
-        coeffs = pywt.wavedec(ts, 'db1', level = n-1)
-        
-        # prepare output lists and append coefficients which will not be shuffled
-        coeffs_tilde = []
-        for j in range(randomise_from_scale):
-            coeffs_tilde.append(coeffs[j])
+        words = []
+        while True:
+            words.append(seed & 0xffffffff)
+            seed >>= 32
+            if seed == 0:
+                break
+        return [ np.random.RandomState(words + [start + i]) for i in range(num) ]
+
+
+
+def _permute_columns(arr, rng):
+    """
+    Independently permutes every column of arr (length x columns) using rng.
+    """
+
+    return np.take_along_axis(arr, rng.uniform(size = arr.shape).argsort(axis = 0), axis = 0)
+
+
+
+def _compute_MF_surrogates_batch(data, randomise_from_scale, rngs):
+    """
+    Computes multifractal surrogates of all time series in data (time x space) at once, for
+    every random generator in rngs one realisation. Multiplicators and the cascade are built 
+    for all series and realisations per scale at once.
+    Returns surrogates as realisations x time x space.
+    """
+
+    import pywt
+
+    num_tm, num_ts = data.shape
+    num_real = len(rngs)
+
+    n = int(np.log2(num_tm)) # time series length should be 2^n
+    n_real = np.log2(num_tm)
     
-        shuffled_coeffs = []
-        for j in range(randomise_from_scale):
-            shuffled_coeffs.append(coeffs[j])
-        
-        # run for each desired scale
-        for j in range(randomise_from_scale, len(coeffs)):
-            
-            # get multiplicators for scale j
-            multiplicators = np.zeros_like(coeffs[j])
-            for k in range(coeffs[j-1].shape[0]):
-                if coeffs[j-1][k] == 0:
-                    print("**WARNING: some zero coefficients in DWT transform!")
-                    coeffs[j-1][k] = 1
-                multiplicators[2*k] = coeffs[j][2*k] / coeffs[j-1][k]
-                multiplicators[2*k+1] = coeffs[j][2*k+1] / coeffs[j-1][k]
-           
-            # shuffle multiplicators in scale j randomly
-            coef = np.zeros_like(multiplicators)
-            multiplicators = np.random.permutation(multiplicators)
-            
-            # get coefficients with tilde according to a cascade
-            for k in range(coeffs[j-1].shape[0]):
-                coef[2*k] = multiplicators[2*k] * coeffs_tilde[j-1][k]
-                coef[2*k+1] = multiplicators[2*k+1] * coeffs_tilde[j-1][k]
-            coeffs_tilde.append(coef)
-            
-            # sort original coefficients
-            coeffs[j] = np.sort(coeffs[j])
-            
-            # sort shuffled coefficients
-            idx = np.argsort(coeffs_tilde[j])
-            
-            # finally, rearange original coefficient according to coefficient with tilde
-            temporary = np.zeros_like(coeffs[j])
-            temporary[idx] = coeffs[j]
-            shuffled_coeffs.append(temporary)
-        
-        # return randomised time series as inverse discrete wavelet transform
-        mf_surr = pywt.waverec(shuffled_coeffs, 'db1')
+    if n != n_real:
+        # if time series length is not 2^n
+        raise Exception("Time series length must be power of 2 (2^n).")
 
-    else:
-        mf_surr = np.nan
-        
-    return (i, mf_surr)
+    # all realisations as columns
+    x = np.tile(data, (1, num_real))
+
+    # get coefficient from discrete wavelet transform, 
+    # it is a list of length n with numpy arrays (scale x series) as every object
+    coeffs = pywt.wavedec(x, 'db1', level = n-1, axis = 0)
+
+    # prepare output lists and append coefficients which will not be shuffled
+    coeffs_tilde = coeffs[:randomise_from_scale]
+    shuffled_coeffs = coeffs[:randomise_from_scale]
+
+    # run for each desired scale
+    for j in range(randomise_from_scale, len(coeffs)):
+
+        # get multiplicators for scale j
+        if np.any(coeffs[j-1] == 0):
+            print("**WARNING: some zero coefficients in DWT transform!")
+            coeffs[j-1][coeffs[j-1] == 0] = 1
+        multiplicators = coeffs[j] / np.repeat(coeffs[j-1], 2, axis = 0)
+
+        # shuffle multiplicators in scale j randomly, each realisation with its own generator
+        for k in range(num_real):
+            multiplicators[:, k*num_ts:(k+1)*num_ts] = _permute_columns(multiplicators[:, k*num_ts:(k+1)*num_ts], rngs[k])
+
+        # get coefficients with tilde according to a cascade
+        coeffs_tilde.append(multiplicators * np.repeat(coeffs_tilde[j-1], 2, axis = 0))
+
+        # sort original coefficients -- as in the single series version, the sorted coefficients
+        # are also used for multiplicators of the next scale
+        coeffs[j] = np.sort(coeffs[j], axis = 0)
+
+        # finally, rearange original coefficient according to coefficient with tilde
+        temporary = np.empty_like(coeffs[j])
+        np.put_along_axis(temporary, np.argsort(coeffs_tilde[j], axis = 0), coeffs[j], axis = 0)
+        shuffled_coeffs.append(temporary)
+
+    # return randomised time series as inverse discrete wavelet transform
+    mf_surr = pywt.waverec(shuffled_coeffs, 'db1', axis = 0)
+    mf_surr = np.reshape(mf_surr, (num_tm, num_real, num_ts)).transpose((1, 0, 2))
+    mf_surr[:, :, np.all(np.isnan(data), axis = 0)] = np.nan
+
+    return mf_surr
 
 
 
@@ -465,6 +554,7 @@ class SurrogateField(DataField):
         self.data = None
         self.model_grid = None
         self.original_data = data
+        self.plan = None
         
 
         
@@ -483,6 +573,7 @@ class SurrogateField(DataField):
         else:
             self.lats = None
         self.time = field.time.copy()
+        self.plan = None
         
         
         
@@ -543,7 +634,58 @@ class SurrogateField(DataField):
         
 
 
-    def construct_fourier_surrogates(self, algorithm = 'FT', pool = None, preserve_corrs = False, n_iterations = 10):
+    def get_plan(self, dtype = np.float64):
+        """
+        Returns SurrogatePlan of the original data in dtype, which is reused by all Fourier type surrogates.
+        The plan is rebuilt when original_data is replaced or other dtype is requested; after changing 
+        original_data in place, set plan to None.
+        """
+
+        if self.plan is None or self.plan.original is not self.original_data or self.plan.dtype != np.dtype(dtype):
+            self.plan = SurrogatePlan(self.original_data, dtype)
+
+        return self.plan
+
+
+
+    def _get_fourier_surrogates(self, rngs, algorithm, preserve_corrs, n_iterations, dtype, tol = None):
+        """
+        Constructs Fourier type surrogates of the whole field at once, one realisation per 
+        random generator in rngs. Returns len(rngs) x time x space array (for flattened space).
+        For IAAFT, number of iterations and final spectral error per surrogate are stored
+        as iaaft_iterations and iaaft_spectral_error.
+        """
+
+        if algorithm not in ['FT', 'AAFT', 'IAAFT']:
+            raise Exception("Unknown algorithm type, please use 'FT', 'AAFT' or 'IAAFT'.")
+
+        # the whole pipeline runs in the requested precision
+        plan = self.get_plan(dtype)
+        data = plan.data
+
+        # generate uniformly distributed random angles and gaussian noise, each realisation from its generator
+        angle = np.zeros((len(rngs), plan.num_freq, 1 if preserve_corrs else data.shape[1]), dtype = plan.dtype)
+        gaussian = np.zeros((len(rngs),) + data.shape, dtype = plan.dtype) if algorithm != 'FT' else None
+        for k, rng in enumerate(rngs):
+            angle[k] = rng.uniform(0, 2 * np.pi, angle.shape[1:])
+            if gaussian is not None:
+                gaussian[k] = rng.randn(*data.shape)
+        # set the slowest frequency to zero, i.e. not to be randomised
+        angle[:, 0, :] = 0
+
+        if algorithm == 'FT':
+            surrs = _compute_FT_surrogates_batch(plan, angle)
+        elif algorithm == 'AAFT':
+            surrs = _compute_AAFT_surrogates_batch(plan, angle, gaussian)
+        elif algorithm == 'IAAFT':
+            surrs, self.iaaft_iterations, self.iaaft_spectral_error = _compute_IAAFT_surrogates_batch(plan, angle, n_iterations, tol, gaussian)
+
+        return surrs
+
+
+
+    def construct_fourier_surrogates(self, algorithm = 'FT', pool = None, preserve_corrs = False, n_iterations = 10, 
+                                        dtype = np.float64, tol = None, seed = None):
         """
         Constructs Fourier Transform (FT) surrogates - shuffles angle in Fourier space of the original data.
         algorithm:
@@ -551,131 +693,108 @@ class SurrogateField(DataField):
             AAFT - amplitude adjusted FT surrogates [2]
             IAAFT - iterative amplitude adjusted FT surrogates [3]
         pool:
-            instance of multiprocessing's pool in order to exploit multithreading for high-dimensional data
+            not used, kept for compatibility -- the surrogates are computed for the whole field at once
         preserve_corrs:
             bool, whether to preserve covariance structure in spatially distributed data
         n_iterations:
-            int, only when algorithm = IAAFT, number of iterations
+            int, only when algorithm = IAAFT, maximum number of iterations, the iteration of each series
+            stops earlier when its ranks stop changing
+        tol:
+            float or None, only when algorithm = IAAFT, the iteration of each series stops when its relative
+            spectral error falls below tol; number of iterations and final spectral error are stored as
+            iaaft_iterations and iaaft_spectral_error
+        dtype:
+            precision of surrogate data, np.float64 or np.float32
+        seed:
+            integer or None, when None, random seed, else fixed seed
         """
-
-        if algorithm not in ['FT', 'AAFT', 'IAAFT']:
-            raise Exception("Unknown algorithm type, please use 'FT', 'AAFT' or 'IAAFT'.")
         
         if self.original_data is not None:
 
-            np.random.seed()
-            
-            if pool is None:
-                map_func = map
-            else:
-                map_func = pool.map
+            self.data = np.reshape(self._get_fourier_surrogates([np.random.RandomState(seed)], algorithm, preserve_corrs, 
+                                    n_iterations, dtype, tol)[0], 
+                                    self.original_data.shape)
+            if algorithm == 'IAAFT':
+                self.iaaft_iterations = np.reshape(self.iaaft_iterations[0], self.original_data.shape[1:])
+                self.iaaft_spectral_error = np.reshape(self.iaaft_spectral_error[0], self.original_data.shape[1:])
+           
+        else:
+            raise Exception("No data to randomise in the field. First you must copy some DataField.")
 
-            if algorithm == 'FT':
-                surr_func = _compute_FT_surrogates
-            elif algorithm == 'AAFT':
-                surr_func = _compute_AAFT_surrogates
-            elif algorithm == 'IAAFT':
-                surr_func = _compute_IAAFT_surrogates
-                
-            if self.original_data.ndim > 1:
-                orig_shape = self.original_data.shape
-                self.original_data = np.reshape(self.original_data, (self.original_data.shape[0], np.prod(orig_shape[1:])))
-            else:
-                orig_shape = None
-                self.original_data = self.original_data[:, np.newaxis]
-                
-            # generate uniformly distributed random angles
-            a = np.fft.rfft(np.random.rand(self.original_data.shape[0]), axis = 0)
-            if preserve_corrs:
-                angle = np.random.uniform(0, 2 * np.pi, (a.shape[0],))
-                # set the slowest frequency to zero, i.e. not to be randomised
-                angle[0] = 0
-                del a
-                if algorithm == 'IAAFT':
-                    job_data = [ (i, n_iterations, self.original_data[:, i], angle) for i in range(self.original_data.shape[1]) ]    
-                else:
-                    job_data = [ (i, self.original_data[:, i], angle) for i in range(self.original_data.shape[1]) ]
-            else:
-                angle = np.random.uniform(0, 2 * np.pi, (a.shape[0], self.original_data.shape[1]))
-                angle[0, ...] = 0
-                del a
-                if algorithm == 'IAAFT':
-                    job_data = [ (i, n_iterations, self.original_data[:, i], angle[:, i]) for i in range(self.original_data.shape[1]) ]
-                else:
-                    job_data = [ (i, self.original_data[:, i], angle[:, i]) for i in range(self.original_data.shape[1]) ]
-            
-            job_results = map_func(surr_func, job_data)
-            
-            self.data = np.zeros_like(self.original_data)
-            
-            for i, surr in job_results:
-                self.data[:, i] = surr
-                
-            # squeeze single-dimensional entries (e.g. station data)
-            self.data = np.squeeze(self.data)
-            self.original_data = np.squeeze(self.original_data)
 
-            # reshape back to original shape
-            if orig_shape is not None:
-                self.data = np.reshape(self.data, orig_shape)
-                self.original_data = np.reshape(self.original_data, orig_shape)
-           
+
+    def get_fourier_surrogates_block(self, num_surr, algorithm = 'FT', preserve_corrs = False, n_iterations = 10, 
+                                        dtype = np.float64, tol = None, seed = None):
+        """
+        Returns num_surr Fourier Transform surrogates at once as num_surr x original data shape array.
+        For algorithm, preserve_corrs, n_iterations and tol see construct_fourier_surrogates.
+        Every realisation has its own random generator derived from seed, so the block is
+        reproducible for fixed seed.
+        """
+
+        if self.original_data is not None:
+
+            surrs = self._get_fourier_surrogates(_get_seed_stream(seed, num_surr), algorithm, preserve_corrs, n_iterations, dtype, tol)
+            if algorithm == 'IAAFT':
+                self.iaaft_iterations = np.reshape(self.iaaft_iterations, [num_surr] + list(self.original_data.shape[1:]))
+                self.iaaft_spectral_error = np.reshape(self.iaaft_spectral_error, [num_surr] + list(self.original_data.shape[1:]))
+
+            return np.reshape(surrs, [num_surr] + list(self.original_data.shape))
+
         else:
             raise Exception("No data to randomise in the field. First you must copy some DataField.")
 
-            
 
-    def construct_multifractal_surrogates(self, pool = None, randomise_from_scale = 2):
+
+    def construct_multifractal_surrogates(self, pool = None, randomise_from_scale = 2, seed = None):
         """
         Constructs multifractal surrogates (independent shuffling of the scale-specific coefficients,
         preserving so-called multifractal structure - hierarchical process exhibiting information flow
         from large to small scales)
         written according to: Palus, M. (2008): Bootstraping multifractals: Surrogate data from random 
         cascades on wavelet dyadic trees. Phys. Rev. Letters, 101.
+        pool is not used, kept for compatibility -- surrogates are computed for the whole field at once.
+        seed / integer : when None, random seed, else fixed seed.
         """
-
-        import pywt
         
         if self.original_data is not None:
 
-            if pool is None:
-                map_func = map
-            else:
-                map_func = pool.map
+            data = np.reshape(self.original_data, (self.original_data.shape[0], -1))
+            self.data = np.reshape(_compute_MF_surrogates_batch(data, randomise_from_scale, _get_seed_stream(seed, 1))[0], 
+                                    self.original_data.shape)
             
-            if self.original_data.ndim > 1:
-                orig_shape = self.original_data.shape
-                self.original_data = np.reshape(self.original_data, (self.original_data.shape[0], np.prod(orig_shape[1:])))
-            else:
-                orig_shape = None
-                self.original_data = self.original_data[:, np.newaxis]
-            
-            self.data = np.zeros_like(self.original_data)
+        else:
+            raise Exception("No data to randomise in the field. First you must copy some DataField.")
 
-            job_data = [ (i, self.original_data[:, i], randomise_from_scale, None) for i in range(self.original_data.shape[1]) ]
-            job_results = map_func(_compute_MF_surrogates, job_data)
-            
-            for i, surr in job_results:
-                self.data[:, i] = surr
-            
-            # squeeze single-dimensional entries (e.g. station data)
-            self.data = np.squeeze(self.data)
-            self.original_data = np.squeeze(self.original_data)
 
-            # reshape back to original shape
-            if orig_shape is not None:
-                self.data = np.reshape(self.data, orig_shape)
-                self.original_data = np.reshape(self.original_data, orig_shape)
-            
+
+    def get_multifractal_surrogates_block(self, num_surr, randomise_from_scale = 2, seed = None):
+        """
+        Returns num_surr multifractal surrogates at once as num_surr x original data shape array.
+        Every realisation has its own random generator derived from seed, so the block is
+        reproducible for fixed seed.
+        """
+
+        if self.original_data is not None:
+
+            data = np.reshape(self.original_data, (self.original_data.shape[0], -1))
+            surrs = _compute_MF_surrogates_batch(data, randomise_from_scale, _get_seed_stream(seed, num_surr))
+
+            return np.reshape(surrs, [num_surr] + list(self.original_data.shape))
+
         else:
             raise Exception("No data to randomise in the field. First you must copy some DataField.")
-        
 
 
-    def prepare_AR_surrogates(self, pool = None, order_range = [1, 1], crit = 'sbc'):
+
+    def prepare_AR_surrogates(self, pool = None, order_range = [1, 1], crit = 'sbc', num_workers = 0, cache_dir = None):
         """
         Prepare for generating AR(k) surrogates by identifying the AR model and computing
         the residuals. Adapted from script by Vejmelka -- https://github.com/vejmelkam/ndw-climate
+        If num_workers > 0, models are identified in a pool of num_workers processes which read
+        the data from shared memory (pool is then not used).
+        If cache_dir is given, identified models and residuals are stored there keyed by hash of
+        the data, order range and criterion, and loaded instead of refitting when available.
         """
         
         if self.original_data is not None:
@@ -692,24 +811,58 @@ class SurrogateField(DataField):
                 orig_shape = None
                 self.original_data = self.original_data[:, np.newaxis]
             num_tm = self.time.shape[0]
-                
-            job_data = [ (i, order_range, crit, self.original_data[:, i]) for i in range(self.original_data.shape[1]) ]
-            job_results = map_func(_prepare_AR_surrogates, job_data)
+            num_pts = self.original_data.shape[1]
+
+            job_results = None
+            if cache_dir is not None:
+                import cPickle
+                cache_fname = _get_AR_cache_fname(cache_dir, self.original_data, order_range, crit)
+                if os.path.exists(cache_fname):
+                    with open(cache_fname, "rb") as f:
+                        job_results = cPickle.load(f)
+
+            if job_results is None:
+                if num_workers > 0:
+                    from multiprocessing import Pool, RawArray
+                    raw = RawArray('d', int(np.prod(self.original_data.shape)))
+                    np.reshape(np.frombuffer(raw, dtype = np.float64), self.original_data.shape)[:] = self.original_data
+                    ar_pool = Pool(num_workers, initializer = _init_AR_worker, initargs = (raw, self.original_data.shape))
+                    job_data = [ (i, order_range, crit) for i in range(num_pts) ]
+                    job_results = ar_pool.map(_prepare_AR_surrogates_shared, job_data)
+                    ar_pool.close()
+                    ar_pool.join()
+                else:
+                    job_data = [ (i, order_range, crit, self.original_data[:, i]) for i in range(num_pts) ]
+                    job_results = list(map_func(_prepare_AR_surrogates, job_data))
+
+                if cache_dir is not None:
+                    # write to temporary file first, so interrupted run does not leave broken cache
+                    with open(cache_fname + ".tmp", "wb") as f:
+                        cPickle.dump(job_results, f, protocol = cPickle.HIGHEST_PROTOCOL)
+                    os.rename(cache_fname + ".tmp", cache_fname)
+
             max_ord = 0
             for r in job_results:
                 if r[1] is not None and r[1].order() > max_ord:
                     max_ord = r[1].order()
             num_tm_s = num_tm - max_ord
             
-            self.model_grid = np.zeros((np.prod(orig_shape[1:]),), dtype = np.object)
-            self.residuals = np.zeros((num_tm_s, np.prod(orig_shape[1:])), dtype = np.float64)
+            self.model_grid = np.zeros((num_pts,), dtype = np.object)
+            self.residuals = np.zeros((num_tm_s, num_pts), dtype = np.float64)
+            # coefficients of all models in one array for batched simulation
+            self.ar_coeffs = np.zeros((max_ord, num_pts), dtype = np.float64)
+            self.ar_intercepts = np.zeros((num_pts,), dtype = np.float64)
     
             for i, v, r in job_results:
                 self.model_grid[i] = v
                 if v is not None:
                     self.residuals[:, i] = r[:num_tm_s, 0]
+                    self.ar_coeffs[:v.order(), i] = v.A[0, :]
+                    self.ar_intercepts[i] = v.w[0]
                 else:
                     self.residuals[:, i] = np.nan
+                    self.ar_coeffs[:, i] = np.nan
+                    self.ar_intercepts[i] = np.nan
     
             self.max_ord = max_ord
             
@@ -721,61 +874,114 @@ class SurrogateField(DataField):
                 self.original_data = np.reshape(self.original_data, orig_shape)
                 self.model_grid = np.reshape(self.model_grid, list(orig_shape[1:]))
                 self.residuals = np.reshape(self.residuals, [num_tm_s] + list(orig_shape[1:]))
+                self.ar_coeffs = np.reshape(self.ar_coeffs, [max_ord] + list(orig_shape[1:]))
+                self.ar_intercepts = np.reshape(self.ar_intercepts, list(orig_shape[1:]))
             
         else:
             raise Exception("No data to randomise in the field. First you must copy some DataField.")
         
         
         
-    def construct_surrogates_with_residuals(self, pool = None):
+    def _get_AR_surrogates(self, rngs):
+        """
+        Constructs AR(k) surrogates of the whole field at once, one realisation per random
+        generator in rngs. Returns len(rngs) x time x space array (for flattened space).
+        """
+
+        num_tm_s = self.time.shape[0] - self.max_ord
+        residuals = np.reshape(self.residuals, (num_tm_s, -1))
+        coeffs = np.reshape(self.ar_coeffs, (self.max_ord, -1))
+        intercepts = np.reshape(self.ar_intercepts, (-1,))
+        valid = np.logical_not(np.isnan(intercepts))
+        num_valid = np.sum(valid)
+
+        # permute residuals of all series, realisations are stacked along space
+        perm_res = np.zeros((num_tm_s, len(rngs) * num_valid))
+        for k, rng in enumerate(rngs):
+            perm_res[:, k*num_valid:(k+1)*num_valid] = _permute_columns(residuals[:, valid], rng)
+
+        surrs = np.zeros((len(rngs), num_tm_s, residuals.shape[1]))
+        surrs[:, :, np.logical_not(valid)] = np.nan
+        ar_surrs = _compute_AR_surrogates_batch(np.tile(coeffs[:, valid], (1, len(rngs))), 
+                                                np.tile(intercepts[valid], len(rngs)), perm_res)
+        surrs[:, :, valid] = np.reshape(ar_surrs, (num_tm_s, len(rngs), num_valid)).transpose((1, 0, 2))
+
+        return surrs
+
+
+
+    def construct_surrogates_with_residuals(self, pool = None, seed = None):
         """
         Constructs a new surrogate time series from AR(k) model.
+        Residuals of all series are permuted at once and AR recursion runs for all series together.
+        pool is not used, kept for compatibility.
+        seed / integer : when None, random seed, else fixed seed.
         Adapted from script by Vejmelka -- https://github.com/vejmelkam/ndw-climate
         """
         
         if self.model_grid is not None:
-            
-            if pool is None:
-                map_func = map
-            else:
-                map_func = pool.map
-            
-            if self.original_data.ndim > 1:
-                orig_shape = self.original_data.shape
-                self.original_data = np.reshape(self.original_data, (self.original_data.shape[0], np.prod(orig_shape[1:])))
-                self.model_grid = np.reshape(self.model_grid, np.prod(self.model_grid.shape))
-                self.residuals = np.reshape(self.residuals, (self.residuals.shape[0], np.prod(orig_shape[1:])))
-            else:
-                orig_shape = None
-                self.original_data = self.original_data[:, np.newaxis]
-                self.model_grid = self.model_grid[:, np.newaxis]
-                self.residuals = self.residuals[:, np.newaxis]
-            num_tm_s = self.time.shape[0] - self.max_ord
-            
-            job_data = [ (i,  self.residuals[:, i], self.model_grid[i], num_tm_s, None) for i in range(self.original_data.shape[1]) ]
-            job_results = map_func(_compute_AR_surrogates, job_data)
-            
-            self.data = np.zeros((num_tm_s, self.original_data.shape[1]))
-            
-            for i, surr in job_results:
-                self.data[:, i] = surr
-                    
-            self.data = np.squeeze(self.data)
-            self.original_data = np.squeeze(self.original_data)
-            self.residuals = np.squeeze(self.residuals)
 
-            # reshape back to original shape
-            if orig_shape is not None:
-                self.original_data = np.reshape(self.original_data, orig_shape)
-                self.model_grid = np.reshape(self.model_grid, list(orig_shape[1:]))
-                self.residuals = np.reshape(self.residuals, [num_tm_s] + list(orig_shape[1:]))
-                self.data = np.reshape(self.data, [num_tm_s] + list(orig_shape[1:]))
+            num_tm_s = self.time.shape[0] - self.max_ord
+            self.data = np.reshape(self._get_AR_surrogates([np.random.RandomState(seed)])[0], 
+                                    [num_tm_s] + list(self.original_data.shape[1:]))
 
         else:
            raise Exception("The AR(k) model is not simulated yet. First, prepare surrogates!") 
 
 
 
+    def iter_surrogates(self, n, algorithm = 'FT', seed = None, batch_size = None, start = 0, **kwargs):
+        """
+        Generator of n surrogates of the original data, constructed lazily. If batch_size is None,
+        yields single surrogates with the original data shape, else yields blocks of (at most) batch_size 
+        surrogates as block size x original data shape.
+        algorithm:
+            'FT', 'AAFT', 'IAAFT' -- Fourier type surrogates, kwargs are passed as in get_fourier_surrogates_block
+            'MF' -- multifractal surrogates, kwargs may contain randomise_from_scale
+            'AR' -- AR(k) surrogates, the model has to be prepared by prepare_AR_surrogates first
+        seed:
+            every realisation has its own independent random generator derived from seed, so the 
+            surrogates do not depend on batch_size; realisations start, ..., start + n - 1 are 
+            generated, hence the work can be split into processes by start with the same seed.
+            When None, random seed.
+        """
+
+        if algorithm in ['FT', 'AAFT', 'IAAFT', 'MF']:
+            if self.original_data is None:
+                raise Exception("No data to randomise in the field. First you must copy some DataField.")
+            shape = list(self.original_data.shape)
+        elif algorithm == 'AR':
+            if self.model_grid is None:
+                raise Exception("The AR(k) model is not simulated yet. First, prepare surrogates!")
+            shape = [self.time.shape[0] - self.max_ord] + list(self.original_data.shape[1:])
+        else:
+            raise Exception("Unknown algorithm type, please use 'FT', 'AAFT', 'IAAFT', 'MF' or 'AR'.")
+
+        # fix the seed now, so all the batches come from the same stream
+        if seed is None:
+            seed = _get_fresh_seed()
+
+        step = 1 if batch_size is None else batch_size
+        for i in range(start, start + n, step):
+            rngs = _get_seed_stream(seed, min(step, start + n - i), start = i)
+
+            if algorithm == 'MF':
+                data = np.reshape(self.original_data, (self.original_data.shape[0], -1))
+                surrs = _compute_MF_surrogates_batch(data, kwargs.get('randomise_from_scale', 2), rngs)
+            elif algorithm == 'AR':
+                surrs = self._get_AR_surrogates(rngs)
+            else:
+                surrs = self._get_fourier_surrogates(rngs, algorithm, kwargs.get('preserve_corrs', False), 
+                            kwargs.get('n_iterations', 10), kwargs.get('dtype', np.float64), kwargs.get('tol', None))
+
+            surrs = np.reshape(surrs, [len(rngs)] + shape)
+            if batch_size is None:
+                yield surrs[0]
+            else:
+                yield surrs
+
+
+
     def amplitude_adjust_surrogates(self, mean, var, trend, pool = None):
         """
         Performs amplitude adjustment to already created surrogate data. 
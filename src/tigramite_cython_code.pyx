@@ -1,73 +1,147 @@
 import numpy
 cimport numpy
 import cython
-from libc.math cimport abs
+from cython.parallel import prange
+from libc.math cimport fabs
 
-cdef inline double max(double a, double b): return a if a >= b else b
+cdef inline double max(double a, double b) nogil: return a if a >= b else b
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def _get_neighbors_within_eps_cython(
-            double[:,:] array, 
-            int T, 
-            int dim_x, 
-            int dim_y, 
-            double[:] epsarray,
-            int k,
-            int dim):
-
-    cdef int[:] k_xz = numpy.zeros(T, dtype='int32')
-    cdef int[:] k_yz = numpy.zeros(T, dtype='int32')
-    cdef int[:] k_z = numpy.zeros(T, dtype='int32')
-
-    cdef int i, j, d, kz, kxz, kyz
-    cdef double dz, dy, dx, epsmax
+cdef int _count_in_subspace(double[:, :] array, int d0, int d1, int[:] order, int[:] rank, 
+                            int i, double epsmax) nogil:
+    """
+    Counts points j with max_d |array[d, i] - array[d, j]| < epsmax over dimensions d0 <= d < d1,
+    including i itself. order sorts the points along d0, rank is its inverse, so only 
+    the window of points closer than epsmax in d0 is scanned -- |array[d0, i] - x| is monotone 
+    on either side of i in sorted order, so the window ends at the first miss.
+    """
+
+    cdef int T = order.shape[0]
+    cdef int count = 0
+    cdef int p, j, d, step
+    cdef double dist
+
+    # scan up from i's own position (inclusive), then down
+    for step in range(2):
+        p = rank[i] if step == 0 else rank[i] - 1
+        while p >= 0 and p < T:
+            j = order[p]
+            if not fabs(array[d0, i] - array[d0, j]) < epsmax:
+                break
+            dist = 0.
+            for d in range(d0 + 1, d1):
+                dist = max(fabs(array[d, i] - array[d, j]), dist)
+            if dist < epsmax:
+                count += 1
+            p = p + 1 if step == 0 else p - 1
+
+    return count
 
-    # Loop over time points
-    for i in range(T):
 
-        # Epsilon of k-th nearest neighbor in joint space
-        epsmax = epsarray[i]
 
-        # Count neighbors within epsmax in subspaces, since the reference
-        # point is included, all neighbors are at least 1
-        kz = 0
-        kxz = 0
-        kyz = 0
-        for j in range(T):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _count_in_z_window(double[:, :] array, int dim_x, int dim_y, int[:] order, int[:] rank,
+                             int i, double epsmax, int[:] k_xz, int[:] k_yz, int[:] k_z) nogil:
+    """
+    Counts neighbours of i in Z, YZ and XZ subspaces as the brute force scan, but only
+    over the window of points closer than epsmax in the first Z dimension (sorted by order).
+    """
+
+    cdef int T = order.shape[0]
+    cdef int dim = array.shape[0]
+    cdef int kz = 0, kxz = 0, kyz = 0
+    cdef int p, j, d, step
+    cdef double dz, dy, dx
+
+    for step in range(2):
+        p = rank[i] if step == 0 else rank[i] - 1
+        while p >= 0 and p < T:
+            j = order[p]
+            if not fabs(array[dim_x + dim_y, i] - array[dim_x + dim_y, j]) < epsmax:
+                break
+            p = p + 1 if step == 0 else p - 1
 
-            # Z-subspace, if empty, dz stays 0
             dz = 0.
-            for d in range(dim_x+dim_y, dim):
-                dz = max( abs(array[d, i] - array[d, j]), dz)
- 
-            # For no conditions, kz is counted up to T
-            if (dz < epsmax):
+            for d in range(dim_x + dim_y + 1, dim):
+                dz = max(fabs(array[d, i] - array[d, j]), dz)
+            if dz < epsmax:
                 kz += 1
 
-                # Only now check Y- and X-subspaces
-
-                # Y-subspace, the loop is only entered for dim_y > 1
-                dy = abs(array[dim_x, i] - array[dim_x, j])
-                for d in range(dim_x+1, dim_x+dim_y):
-                    dy = max( abs(array[d, i] - array[d, j]), dy)
-                
-                if (dy < epsmax):
+                dy = 0.
+                for d in range(dim_x, dim_x + dim_y):
+                    dy = max(fabs(array[d, i] - array[d, j]), dy)
+                if dy < epsmax:
                     kyz += 1
 
-                # X-subspace, the loop is only entered for dim_x > 1
-                dx = abs(array[0, i] - array[0, j])
-                for d in range(1, dim_x):
-                    dx = max( abs(array[d, i] - array[d, j]), dx)
-   
-                if (dx < epsmax):
+                dx = 0.
+                for d in range(dim_x):
+                    dx = max(fabs(array[d, i] - array[d, j]), dx)
+                if dx < epsmax:
                     kxz += 1
-               
-        # Write to arrays
-        k_xz[i] = kxz
-        k_yz[i] = kyz
-        k_z[i] = kz
 
+    k_xz[i] = kxz
+    k_yz[i] = kyz
+    k_z[i] = kz
+
+
+
+def _get_sorting(double[:, :] array, int dim):
+    """
+    Returns order of points sorted along dimension dim and its inverse.
+    """
+
+    order = numpy.argsort(numpy.asarray(array[dim, :]), kind = 'mergesort').astype('int32')
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(order.shape[0], dtype = 'int32')
+
+    return order, rank
+
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _get_neighbors_within_eps_cython(
+            double[:,:] array, 
+            int T, 
+            int dim_x, 
+            int dim_y, 
+            double[:] epsarray,
+            int k,
+            int dim,
+            int num_threads = 0):
+    """
+    Counts neighbours of every point closer than epsarray (max norm) in subspaces XZ, YZ and Z,
+    the point itself included. For no conditions, k_z is T.
+    Points are sorted along the first Z dimension (or along X and Y for no conditions) and
+    only points closer than epsarray in that dimension are checked. Loop over points runs in num_threads 
+    OpenMP threads (all cores if <= 0) when compiled with OpenMP.
+    """
+
+    cdef int[:] k_xz = numpy.zeros(T, dtype='int32')
+    cdef int[:] k_yz = numpy.zeros(T, dtype='int32')
+    cdef int[:] k_z = numpy.zeros(T, dtype='int32')
+    cdef int i
+    cdef int[:] x_order, x_rank, y_order, y_rank, z_order, z_rank
+
+    if num_threads <= 0:
+        import multiprocessing
+        num_threads = multiprocessing.cpu_count()
+
+    if dim > dim_x + dim_y:
+        # all subspaces contain Z, so one window along its first dimension serves all
+        z_order, z_rank = _get_sorting(array, dim_x + dim_y)
+        for i in prange(T, nogil = True, schedule = 'dynamic', chunksize = 64, num_threads = num_threads):
+            _count_in_z_window(array, dim_x, dim_y, z_order, z_rank, i, epsarray[i], k_xz, k_yz, k_z)
+    else:
+        # for no conditions, k_z is counted up to T
+        x_order, x_rank = _get_sorting(array, 0)
+        y_order, y_rank = _get_sorting(array, dim_x)
+        for i in prange(T, nogil = True, schedule = 'dynamic', chunksize = 64, num_threads = num_threads):
+            k_xz[i] = _count_in_subspace(array, 0, dim_x, x_order, x_rank, i, epsarray[i])
+            k_yz[i] = _count_in_subspace(array, dim_x, dim_x + dim_y, y_order, y_rank, i, epsarray[i])
+            k_z[i] = T
 
     return numpy.asarray(k_xz), numpy.asarray(k_yz), numpy.asarray(k_z)
 
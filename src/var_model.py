@@ -16,6 +16,21 @@ import var_model_acc
 
 
 
+def _lagged_predictors(ts, p):
+    """
+    Returns matrix of lagged predictors of time series ts (time x dim) for order p,
+    i.e. row t is [ts[t+p-1], ts[t+p-2], ..., ts[t]] built from a strided view.
+    """
+
+    N, m = ts.shape
+    ts = np.ascontiguousarray(ts)
+    windows = np.lib.stride_tricks.as_strided(ts, shape = (N - p + 1, p, m), 
+        strides = (ts.strides[0], ts.strides[0], ts.strides[1]))
+
+    return np.reshape(windows[:N-p, ::-1, :], (N - p, p*m))
+
+
+
 class VARModel:
     """A VAR(k) model with coefficient matrices.  The model is specified by
        a mean value (w), a coefficient matrix (A) and by a Cholesky factor
@@ -140,8 +155,7 @@ class VARModel:
             K[:N, 0] = 1.0
             
         # set predictors u
-        for j in range(1, p_max + 1):
-            K[:N, fi+(j-1)*m:fi+j*m] = ts[p_max-j:N+p_max-j, :]
+        K[:N, fi:fi+p_max*m] = _lagged_predictors(ts, p_max)
                 
         # set predictors v
         K[:N, n_p[p_max]:n_p[p_max]+m] = ts[p_max:N+p_max, :]
@@ -234,26 +248,14 @@ class VARModel:
         ts = time_series[:, np.newaxis] if time_series.ndim == 1 else time_series
         m, p = self.dimension(), self.order()
         N = ts.shape[0]
-        Nres = N - p
-        res = np.zeros((Nres, m))
-        u = np.zeros((p*m,))
         
-        # pre-fill predictors for first prediction
-        for i in range(1, p+1):
-            u[(i-1)*m:i*m] = ts[p-i, :]
-            
         # copy time series ("residuals" without prediction)
         # subtract mean from all residuals
-        res[:,:] = ts[p:N, :]
-        res -= w
+        res = ts[p:N, :] - w
         
-        Au = np.zeros_like(w)
-        for ndx in range(p, N):
-            # predict and subtract
-            np.dot(A, u, out = Au)
-            res[ndx-p] -= Au
-            u[m:] = u[:-m]
-            u[:m] = ts[ndx, :]
+        # predict all at once from lagged predictors and subtract
+        if p > 0:
+            res -= np.dot(_lagged_predictors(ts, p), A.T)
             
         # what remains are the residuals
         return res
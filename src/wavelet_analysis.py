@@ -83,6 +83,134 @@ def DOG(k, scale, k0 = 2.):
     
     
     
+# daughter wavelets keyed by (wavelet, n, dt, scale, k0), reused by all transforms of the same length
+_daughter_cache = {}
+_MAX_CACHED_DAUGHTERS = 256
+
+
+
+def get_wavenumbers(n, dt):
+    """
+    Returns the array of angular Fourier frequencies of the series of length n with sampling dt,
+    in the order of FFT output.
+    """
+
+    k = np.arange(1, n//2 + 1) * ((2. * np.pi) / (n * dt))
+    k_minus = -k[(n-1)//2 - 1::-1]
+
+    return np.concatenate((np.array([0.]), k, k_minus))
+
+
+
+def get_daughter(n, dt, scale, k0 = 6., wavelet = morlet):
+    """
+    Returns the daughter wavelet in Fourier space for series of length n with sampling dt,
+    its fourier factor and coi factor (see morlet). Daughters are cached, so
+    repeated transforms (e.g. of surrogates) compute them only once.
+    """
+
+    key = (wavelet.__name__, n, dt, scale, k0)
+    if key not in _daughter_cache:
+        if len(_daughter_cache) >= _MAX_CACHED_DAUGHTERS:
+            _daughter_cache.clear()
+        _daughter_cache[key] = wavelet(get_wavenumbers(n, dt), scale, k0)
+
+    return _daughter_cache[key]
+
+
+
+def get_padded_length(n1):
+    """
+    Returns length of the series of length n1 padded with zeros to the power of 2,
+    twice the power of 2 nearest to n1.
+    """
+
+    base2 = int(np.fix(np.log(n1)/np.log(2) + 0.4999999)) # power of 2 nearest to len(X)
+
+    return int(np.power(2, base2 + 1))
+
+
+
+def get_coi(n1, dt, coi_factor):
+    """
+    Returns Cone-of-Influence of the series of length n1 with sampling dt, i.e. maximum period
+    of useful information at particular time. coi_factor as returned by the mother wavelet.
+    """
+
+    return coi_factor * dt * np.concatenate( (np.array([1e-5]), np.arange(1,(n1+1)//2), np.arange((n1//2 - 1),0,-1), np.array([1e-5])) )
+
+
+
+def get_coi_cut(n1, dt, period, wavelet = morlet, k0 = 6.):
+    """
+    Returns number of samples to cut from both ends of the series of length n1 with sampling dt
+    so that the rest lies outside the Cone-of-Influence of the Fourier period (in time units),
+    where edge effects are negligible.
+    """
+
+    _, _, coi_factor = wavelet(get_wavenumbers(max(n1, 2), dt), 1., k0)
+    coi = get_coi(n1, dt, coi_factor)
+
+    return int(np.sum(coi[:(n1+1)//2] < period))
+
+
+
+def continous_wavelet_field(X, dt, pad = False, wavelet = morlet, **kwargs):
+    """
+    Computes the wavelet transform of all time series in X (time x any spatial dimensions)
+    at once, with sampling rate dt. The field is padded once, transformed by one FFT along time,
+    multiplied by cached daughter wavelet for every scale and transformed back for all
+    series together. Series with NaNs are masked out and their transform is NaN.
+    Inputs and kwargs as in continous_wavelet, moreover
+    scales - array of arbitrary scales to use instead of s0 * 2^(j*dj), all are computed
+        from one forward FFT
+
+    outputs:
+    wave - wavelet transform of the X. It is a complex numpy array of dim (number of scales, n, spatial dims)
+    period, scale, coi - as in continous_wavelet
+    """
+    # map arguments
+    dj = kwargs.get('dj', 0.25)
+    s0 = kwargs.get('s0', 2 * dt)
+    k0 = kwargs.get('k0', 6.)
+    n1 = X.shape[0]
+    if 'scales' in kwargs:
+        scale = np.atleast_1d(np.asarray(kwargs['scales'], dtype = np.float64))
+    else:
+        if 'j1' in kwargs:
+            j1 = int(kwargs['j1'])
+        else:
+            j1 = int(np.fix(np.log(n1*dt/s0) / np.log(2)) / dj)
+        scale = s0 * np.power(2., np.arange(0, j1+1) * dj)
+
+    # flatten spatial dims and mask series with NaNs, series are kept in rows for contiguous FFTs
+    Y = np.reshape(X, (n1, -1))
+    valid = np.logical_not(np.any(np.isnan(Y), axis = 0))
+    Y = Y[:, valid].T
+    Y = Y - np.mean(Y, axis = 1)[:, np.newaxis]
+
+    # padding, if needed -- fft pads with zeros to length n
+    n = get_padded_length(n1) if pad else n1
+    
+    # compute FFT of the (padded) field
+    f = fft(Y, n = n, axis = 1)
+    
+    # empty wave array
+    wave = np.empty((scale.shape[0], n1, valid.shape[0]), dtype = np.complex128)
+    wave[:, :, np.logical_not(valid)] = np.nan
+    
+    # loop through scales and compute tranform of all series
+    for i in range(scale.shape[0]):
+        daughter, fourier_factor, coi = get_daughter(n, dt, scale[i], k0, wavelet)
+        wave[i][:, valid] = ifft(f * daughter, axis = 1)[:, :n1].T
+        
+    period = fourier_factor * scale
+    coi = get_coi(n1, dt, coi)
+    
+    return np.reshape(wave, (scale.shape[0],) + X.shape), period, scale, coi
+
+
+
 def continous_wavelet(X, dt, pad = False, wavelet = morlet, **kwargs):
     """
     Computes the wavelet transform of the vector X, with sampling rate dt.
@@ -104,57 +232,7 @@ def continous_wavelet(X, dt, pad = False, wavelet = morlet, **kwargs):
     scale - the vector of scale indices, given by s0 * 2^(j*dj)
     coi - Cone-of-Influence, vector that contains a maximum period of useful information at particular time
     """
-    # map arguments
-    if 'dj' in kwargs:
-        dj = kwargs['dj']
-    else:
-        dj = 0.25
-    if 's0' in kwargs:
-        s0 = kwargs['s0']
-    else:
-        s0 = 2 * dt
-    if 'j1' in kwargs:
-        j1 = kwargs['j1']
-    else:
-        j1 = np.fix(np.log(len(X)*dt/s0) / np.log(2)) / dj
-    if 'k0' in kwargs:
-        k0 = kwargs['k0']
-    else:
-        k0 = 6.
-    
-    n1 = len(X)
-    
-    Y = X - np.mean(X)
-    #Y = X
 
-    # padding, if needed
-    if pad:
-        base2 = int(np.fix(np.log(n1)/np.log(2) + 0.4999999)) # power of 2 nearest to len(X)
-        Y = np.concatenate( (Y, np.zeros((np.power(2, (base2+1))-n1))) )
-    n = len(Y)
-    
-    # wavenumber array
-    k = np.arange(1, np.fix(n/2) + 1)
-    k *= (2. * np.pi) / (n * dt)
-    k_minus = -k[int(np.fix(n-1))/2 - 1::-1]
-    k = np.concatenate((np.array([0.]), k, k_minus))
-    
-    # compute FFT of the (padded) time series
-    f = fft(Y)
-    
-    # construct scale array and empty period & wave arrays
-    scale = np.array( [s0 * np.power(2, x*dj) for x in range(0,j1+1)] )
-    period = scale
-    wave = np.zeros((j1+1, n), dtype = np.complex)
-    
-    # loop through scales and compute tranform
-    for i in range(j1+1):
-        daughter, fourier_factor, coi = wavelet(k, scale[i], k0)
-        wave[i, :] = ifft(f * daughter)
-        
-    period = fourier_factor * scale
-    coi *= dt * np.concatenate( (np.array([1e-5]), np.arange(1,(n1+1)/2), np.arange((n1/2 - 1),0,-1), np.array([1e-5])) )
-    wave = wave[:, :n1]
-    
-    return wave, period, scale, coi
-    
\ No newline at end of file
+    wave, period, scale, coi = continous_wavelet_field(np.asarray(X)[:, np.newaxis], dt, pad, wavelet, **kwargs)
+
+    return wave[..., 0], period, scale, coi